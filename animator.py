@@ -0,0 +1,208 @@
+import artist as a
+import compositor as c
+import tiler as t
+import profiler
+import os
+import numpy as np
+from PIL import Image
+
+
+FORMATS = ["apng","frames"]
+
+
+def twinkle_curves(count: int, frames: int, depth: float = 0.5, seed: int = None) -> np.ndarray:
+    """
+    Opacity of every star through a looping animation, relative to the star alpha.
+    Each star dims and brightens a whole number of times per loop from its own phase, so the loop is seamless.
+
+    Args:
+        count (int): Number of stars
+        frames (int): Number of frames in the loop
+        depth (float): How far stars dim, as a fraction of their opacity
+        seed (int): Seed for the stars' speeds and phases
+
+    Returns:
+        np.ndarray: frames x count opacity factors (1-depth -> 1)
+    """
+    rng = np.random.default_rng(seed)
+    cycles = rng.integers(1,3,size=count)
+    phases = rng.random(count)
+    time = np.arange(frames)[:,None] / frames
+    return 1 - depth * (0.5 - 0.5 * np.cos(2 * np.pi * (cycles * time + phases)))
+
+
+def over(top: tuple, bottom: tuple) -> tuple:
+    """
+    Premultiplied source-over of (rgb, coverage) pairs
+    """
+    rgb,coverage = top
+    return rgb + bottom[0] * (1 - coverage)[...,None],coverage + bottom[1] * (1 - coverage)
+
+
+def to_rgba(rgb: np.ndarray, coverage: np.ndarray) -> np.ndarray:
+    """
+    Convert premultiplied float RGB and coverage to straight uint8 RGBA
+    """
+    image = np.empty(coverage.shape + (4,),dtype=np.uint8)
+    if coverage.min() < 1:
+        rgb = np.divide(rgb,coverage[...,None],out=np.zeros_like(rgb),where=coverage[...,None] > 0)
+    image[...,:3] = np.clip(rgb * 255 + 0.5,0,255)
+    image[...,3] = np.clip(coverage * 255 + 0.5,0,255)
+    return image
+
+
+class Animator:
+
+    @profiler.stage
+    def __init__(self, scene, canvas: a.Canvas, depth: float = 0.5, seed: int = None) -> None:
+        """
+        Twinkling stars, with the background and foreground rasterized once and every star
+        rasterized once as a small sprite. Frames only redo the pixels under the stars,
+        compositing each sprite at its own opacity.
+
+        Args:
+            scene (main.Scene): Scene the canvas was drawn from, for the star layout
+            canvas (a.Canvas): Drawn canvas
+            depth (float): How far stars dim, as a fraction of their opacity
+            seed (int): Seed for the twinkling
+        """
+        self.width = canvas.width
+        self.height = canvas.height
+        self.star_alpha = scene.star_alpha
+        self.depth = depth
+        self.seed = seed
+
+        self.background = c.rasterize_masks(canvas.dumps_layer("background"),self.width,self.height,self.star_alpha)
+        self.foreground = c.rasterize_masks(canvas.dumps_layer("foreground"),self.width,self.height,self.star_alpha)
+        self.sprites = self.rasterize_sprites(scene,canvas)
+
+    @profiler.stage
+    def rasterize_sprites(self, scene, canvas: a.Canvas) -> list:
+        """
+        Rasterize every star on its own, in the smallest pixel-aligned box around it,
+        so it lines up with the rest of the canvas exactly
+
+        Returns:
+            list: ((y0, y1, x0, x1), LayerMasks) for every star on the canvas
+        """
+        xs,ys,_,factors = scene.star_layout(canvas)
+        bx0,by0,bx1,by1 = scene.star_asset.bbox
+
+        sprites = []
+        for x,y,factor in zip(xs.tolist(),ys.tolist(),factors.tolist()):
+            # A pixel of margin for antialiasing
+            x0 = max(int(np.floor(x + factor*bx0)) - 1,0)
+            y0 = max(int(np.floor(y + factor*by0)) - 1,0)
+            x1 = min(int(np.ceil(x + factor*bx1)) + 1,self.width)
+            y1 = min(int(np.ceil(y + factor*by1)) + 1,self.height)
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            sprite = a.Canvas(x1 - x0,y1 - y0)
+            sprite.place_instances(scene.star,[(x - x0,y - y0,factor,self.star_alpha)])
+            masks = c.rasterize_masks(sprite.dumps_layer("detail"),x1 - x0,y1 - y0,self.star_alpha,opaque_stars=True)
+            sprites.append(((y0,y1,x0,x1),masks))
+
+        return sprites
+
+    @profiler.stage
+    def prepare(self, transform_colour_dict: dict) -> None:
+        """
+        Recolour the layers and sprites, once per colour state
+        """
+        self.under = self.background.colour(transform_colour_dict)
+        self.above = self.foreground.colour(transform_colour_dict)
+        self.base = to_rgba(*over(self.above,self.under))
+        self.stars = [(region,masks.colour(transform_colour_dict)) for region,masks in self.sprites]
+
+        # Scratch copy of the background the stars are composited onto
+        self.scratch = (self.under[0].copy(),self.under[1].copy())
+
+    @profiler.stage
+    def frame(self, alphas: np.ndarray) -> np.ndarray:
+        """
+        Composite a frame of the prepared colour state
+
+        Args:
+            alphas (np.ndarray): Opacity of every star
+
+        Returns:
+            np.ndarray: HxWx4 RGBA image
+        """
+        image = self.base.copy()
+        rgb,coverage = self.scratch
+
+        # Overlapping stars are composited in drawing order, so every region starts from the background
+        for (y0,y1,x0,x1),_ in self.stars:
+            rgb[y0:y1,x0:x1] = self.under[0][y0:y1,x0:x1]
+            coverage[y0:y1,x0:x1] = self.under[1][y0:y1,x0:x1]
+
+        for ((y0,y1,x0,x1),(star_rgb,star_coverage)),alpha in zip(self.stars,alphas):
+            region = (slice(y0,y1),slice(x0,x1))
+            rgb[region],coverage[region] = over((alpha * star_rgb,alpha * star_coverage),(rgb[region],coverage[region]))
+
+        for (y0,y1,x0,x1),_ in self.stars:
+            region = (slice(y0,y1),slice(x0,x1))
+            above = (self.above[0][region],self.above[1][region])
+            image[region] = to_rgba(*over(above,(rgb[region],coverage[region])))
+
+        return image
+
+    def frames(self, transform_colour_dict: dict, target_alpha: float, count: int):
+        """
+        Generate the frames of a looping animation
+
+        Args:
+            transform_colour_dict (dict): Colour map, as in Canvas.transform_colours
+            target_alpha (float): Star alpha
+            count (int): Number of frames
+
+        Yields:
+            np.ndarray: HxWx4 RGBA frames
+        """
+        self.prepare(transform_colour_dict)
+        curves = target_alpha * twinkle_curves(len(self.stars),count,self.depth,self.seed)
+        for alphas in curves:
+            yield self.frame(alphas)
+
+    @profiler.stage
+    def export(self,
+               transform_colour_dict: dict,
+               target_alpha: float,
+               path: str,
+               frames: int = 60,
+               fps: float = 15,
+               format: str = "apng",
+               compress_level: int = 1) -> None:
+        """
+        Write a looping animation as an animated PNG, or as a directory of numbered PNG frames
+
+        Args:
+            transform_colour_dict (dict): Colour map, as in Canvas.transform_colours
+            target_alpha (float): Star alpha
+            path (str): Output file, or directory for frames
+            frames (int): Number of frames
+            fps (float): Frames per second
+            format (str): "apng" or "frames"
+            compress_level (int): zlib compression level
+        """
+        match format:
+            case "apng":
+                with t.APNGWriter(path,self.width,self.height,frames,fps,compress_level) as writer:
+                    previous = None
+                    for image in self.frames(transform_colour_dict,target_alpha,frames):
+                        if previous is not None and self.base[...,3].min() == 255:
+                            # Only the stars change, so later frames leave everything else transparent
+                            delta = np.zeros_like(image)
+                            for (y0,y1,x0,x1),_ in self.stars:
+                                delta[y0:y1,x0:x1] = image[y0:y1,x0:x1]
+                            writer.write_frame(delta,blend=True)
+                        else:
+                            writer.write_frame(image)
+                        previous = image
+            case "frames":
+                os.makedirs(path,exist_ok=True)
+                for i,image in enumerate(self.frames(transform_colour_dict,target_alpha,frames)):
+                    Image.fromarray(image,"RGBA").save(os.path.join(path,f"frame_{i:04d}.png"),"PNG",compress_level=compress_level)
+            case _:
+                raise ValueError(f"Unknown animation format : {format}")
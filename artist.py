@@ -1,14 +1,21 @@
+import re
+import lod
+import profiler
 import svgmanip as svg
-import cairosvg as cairo
 from string import digits
 from random import choice
-from lxml.etree import Element,XML
+from lxml.etree import Element,SubElement,XML,tostring
 from copy import deepcopy
 
 
-strip_tag = lambda x : x.replace("{http://www.w3.org/2000/svg}","")
+SVG_NAMESPACE = "{http://www.w3.org/2000/svg}"
+
+strip_tag = lambda x : x.replace(SVG_NAMESPACE,"")
+
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
 
 SVG_ELEMENTS = [
+    "use",
     "path",
     "rect",
     "circle",
@@ -18,6 +25,45 @@ SVG_ELEMENTS = [
     "polygon"
 ]
 
+# Elements may or may not carry the SVG namespace (e.g. the background rect doesn't)
+SVG_TAGS = SVG_ELEMENTS + [SVG_NAMESPACE + tag for tag in SVG_ELEMENTS]
+
+
+def parse_style(style: str) -> dict:
+    """
+    Parse an inline style attribute into its declarations.
+    Later declarations override earlier ones, as they would in CSS.
+
+    Args:
+        style (str): Style attribute, e.g. "fill:#000000;stroke-width:0.2"
+
+    Returns:
+        dict: Declarations as {property : value}
+    """
+    fields = {}
+    for declaration in style.split(";"):
+        if ":" in declaration:
+            key,value = declaration.split(":",1)
+            fields[key.strip()] = value.strip()
+    return fields
+
+
+def format_style(fields: dict) -> str:
+    return ";".join(f"{key}:{value}" for key,value in fields.items())
+
+
+@profiler.stage
+def index_styles(*roots) -> list:
+    """
+    Build a style index of every drawable element under the given roots
+
+    Returns:
+        list: [element, parsed style] pairs, in document order
+    """
+    return [[element,parse_style(element.get("style",""))]
+            for root in roots
+            for element in root.iterdescendants(*SVG_TAGS)]
+
 class Canvas:
     
     bloom_filter_def = """
@@ -49,7 +95,8 @@ class Canvas:
         """
 
 
-        self.canvas = svg.Element(width,height)
+        # Composed lazily from the layers, see compose()
+        self.canvas = None
         
         self.background = svg.Element(width,height)
         self.detail     = svg.Element(width,height)
@@ -74,33 +121,90 @@ class Canvas:
 
         self.aspect_ratio = width/height
 
+        self._styles = None
+
+    def __deepcopy__(self, memo: dict) -> "Canvas":
+        cls = self.__class__
+        copied = cls.__new__(cls)
+        memo[id(self)] = copied
+        for key,value in self.__dict__.items():
+            if key not in ["_styles","canvas"]:
+                setattr(copied,key,deepcopy(value,memo))
+
+        # The composed canvas holds the layers themselves, so copying it as well would duplicate them
+        copied.canvas = None
+
+        # The copied layers are in the same document order, so the index can be carried over without reparsing
+        copied._styles = None
+        if self._styles is not None:
+            elements = (element for obj in copied.layers for element in obj.root.iterdescendants(*SVG_TAGS))
+            copied._styles = [[element,dict(fields)] for element,(_,fields) in zip(elements,self._styles)]
+
+        return copied
+
+    @property
+    def layers(self) -> list:
+        return [self.background,self.detail,self.foreground]
+
+    @property
+    def styles(self) -> list:
+        """
+        Style index of every drawable element on the canvas, built on first use
+        and dropped whenever an object is placed.
+        """
+        if self._styles is None:
+            self._styles = index_styles(*[obj.root for obj in self.layers])
+        return self._styles
+
+    @profiler.stage
     def scale_object( self,
                      obj : svg.Element,
-                     scale: float) -> tuple:
+                     scale: float,
+                     tolerance: float = 0) -> tuple:
         """
         Scale an object BY VALUE in  relation to the canvas
 
         Args:
             object (svg.Element): Element to scale
             scale (float): Fraction of the canvas size (0->1)
+            tolerance (float): Simplify the object's paths for its size on the canvas,
+            moving its outline by at most this many pixels (see lod.simplify)
         
         Returns:
             tuple : Scaled object and its corresponding scale factor
         """
 
         obj = deepcopy(obj)
-        scale_using_width = True if obj.width > obj.height else False
-
-        if scale_using_width:
-            factor = scale * self.width / obj.width
-        else:
-            factor = scale * self.height / obj.height
+        factor = self.get_scale_factor(obj,scale)
+        if tolerance > 0:
+            lod.simplify_tree(obj.root,factor,tolerance)
         
         obj.scale(factor)
 
         return obj,factor
 
+    def get_scale_factor(self,
+                         obj : svg.Element,
+                         scale: float) -> float:
+        """
+        Calculate the factor that scales an object to a fraction of the canvas, without copying it
+
+        Args:
+            object (svg.Element): Element to scale
+            scale (float): Fraction of the canvas size (0->1)
+
+        Returns:
+            float: Scale factor
+        """
+        scale_using_width = True if obj.width > obj.height else False
+
+        if scale_using_width:
+            return scale * self.width / obj.width
+        else:
+            return scale * self.height / obj.height
+
     @staticmethod
+    @profiler.stage
     def set_object_alpha(obj: svg.Element, 
                          fill_alpha : float = 1,
                          stroke_alpha : float = 1) -> svg.Element:
@@ -136,6 +240,7 @@ class Canvas:
         return (x,y)
 
 
+    @profiler.stage
     def place_object(   self,
                         obj : svg.Element,
                         x: float,
@@ -151,20 +256,80 @@ class Canvas:
         """
             
         obj = deepcopy(obj)
+        self._styles = None
+        # Placing wraps the layer in a new root, which the composed canvas doesn't hold yet
+        self.canvas = None
         match layer:
             case "foreground":
                 self.foreground.placeat(obj,x,y)
             case "detail":
                 self.detail.placeat(obj,x,y)
 
+    @profiler.stage
+    def place_instances(self,
+                        obj : svg.Element,
+                        instances,
+                        symbol_id: str = "star",
+                        stroke_alpha: float = 0,
+                        layer: str = "detail") -> None:
+        """
+        Define an object once as a <symbol> and place it as <use> instances on the canvas.
+        Unlike place_object, the object's geometry is not copied per instance.
+
+        Args:
+            object (svg.Element): The (unscaled) object to instance
+            instances (iterable): (x, y, scale factor, fill alpha) for every instance
+            symbol_id (str): Id of the symbol definition
+            stroke_alpha (float): Stroke alpha shared by all instances
+            layer (str): Layer to place the instances on
+        """
+        group = Element(SVG_NAMESPACE + "g")
+        defs = SubElement(group,SVG_NAMESPACE + "defs")
+        symbol = SubElement(defs,SVG_NAMESPACE + "symbol",id=symbol_id,overflow="visible")
+        symbol.append(deepcopy(obj.root))
+
+        href = f"#{symbol_id}"
+        for x,y,factor,fill_alpha in instances:
+            SubElement(group,SVG_NAMESPACE + "use",{
+                XLINK_HREF  : href,
+                "transform" : f"translate({x:.2f},{y:.2f}) scale({factor:.5f})",
+                "style"     : f"fill-opacity:{fill_alpha};stroke-opacity:{stroke_alpha}"
+            })
+
+        self._styles = None
+        match layer:
+            case "foreground":
+                self.foreground.root.append(group)
+            case "detail":
+                self.detail.root.append(group)
+
+    @profiler.stage
     def export(self, path: str) -> None:
-        self.compose()
-        cairo.svg2png(  bytestring=self.canvas.tostr(),
-                        write_to=path,
-                        parent_width=self.width,
-                        parent_height=self.height,
-                        scale=1)
+        rasterize(self.dumps(),path,self.width,self.height)
     
+    @profiler.stage
+    def dumps_layer(self, layer: str) -> bytes:
+        """
+        Serialize a single layer as a canvas-sized SVG, leaving the canvas untouched
+
+        Args:
+            layer (str): One of "background", "detail" or "foreground"
+        """
+        figure = svg.Element(self.width,self.height)
+        figure.placeat(deepcopy(getattr(self,layer)),0,0)
+        return figure.tostr()
+
+    @profiler.stage
+    def compile(self, star_alpha: float) -> "SVGTemplate":
+        """
+        Serialize the canvas once into a template with a slot for every colour and star opacity
+
+        Args:
+            star_alpha (float): Star alpha the canvas was drawn with
+        """
+        return SVGTemplate.compile(self.dumps(),star_alpha)
+
+    @profiler.stage
     def dumps(self) -> str:
         self.compose()
         return self.canvas.tostr()
@@ -173,21 +338,22 @@ class Canvas:
         self.compose()
         self.canvas.dump(path)
 
+    @profiler.stage
     def compose(self) -> None:
-        self.canvas.placeat(self.background,0,0)
-        self.canvas.placeat(self.detail,0,0)
-        self.canvas.placeat(self.foreground,0,0)
+        """
+        Stack the background, detail and foreground layers into the canvas.
+        The layers are held by reference, so this is idempotent: it only does work
+        after an object was placed since the last composition.
+        """
+        if self.canvas is None:
+            self.canvas = svg.Element(self.width,self.height,*self.layers)
 
+    @profiler.stage
     def transform_alpha(self,current_alpha:float,target_alpha:float) -> None:
-        for obj in [self.background,self.detail,self.foreground]:
-            descendants = obj.root.iterdescendants()
-            for descendant in descendants:
-                if strip_tag(descendant.tag) in SVG_ELEMENTS:
-                    style = descendant.get('style')
-                    style = style.replace(f"fill-opacity:{current_alpha}",f"fill-opacity:{target_alpha}")
-                    descendant.set('style',style)
+        transform_index_alpha(self.styles,current_alpha,target_alpha)
 
 
+    @profiler.stage
     def transform_colours(self,transform_colour_dict: dict) -> None:
         """
         
@@ -201,15 +367,136 @@ class Canvas:
                 "#<some-colour-to-replace>" : "#<target-colour>"
             }
         """
-        for obj in [self.background,self.detail,self.foreground]:
-            descendants = obj.root.iterdescendants()
-            for descendant in descendants:
-                if strip_tag(descendant.tag) in SVG_ELEMENTS:
-                    style = descendant.get('style')
-                    for key in transform_colour_dict.keys():
-                        style = style.replace(key,transform_colour_dict[key])
-                    descendant.set('style',style)
+        transform_index_colours(self.styles,transform_colour_dict)
+
+
+def parse_opacity(value: str) -> float:
+    """
+    Numeric opacity of a style value, or None for values such as "inherit" or percentages, which are left alone
+    """
+    try:
+        return float(value)
+    except (TypeError,ValueError):
+        return None
+
+
+def transform_index_alpha(index: list,current_alpha:float,target_alpha:float) -> None:
+    current_alpha = float(current_alpha)
+    for element,fields in index:
+        if parse_opacity(fields.get("fill-opacity")) == current_alpha:
+            fields["fill-opacity"] = f"{target_alpha}"
+            element.set("style",format_style(fields))
+
+
+def transform_index_colours(index: list,transform_colour_dict: dict) -> None:
+    """
+    Recolour every indexed element in a single pass. Each value is looked up once
+    in the original map, so a colour written by one mapping is never remapped by another.
+    """
+    transform = {key.lower() : value for key,value in transform_colour_dict.items()}
+    for element,fields in index:
+        changed = False
+        for key,value in fields.items():
+            target = transform.get(value.lower())
+            if target is not None:
+                fields[key] = target
+                changed = True
+        if changed:
+            element.set("style",format_style(fields))
+
+
+class SVGTemplate:
+
+    slot_pattern = re.compile("@@(.*?)@@")
+    colour_pattern = re.compile("#(?:[0-9a-fA-F]{3}){1,2}")
+
+    alpha_slot = "alpha"
+
+    def __init__(self, source: str) -> None:
+        """
+        A serialized SVG with @@<slot>@@ markers in place of its colours and star opacity.
+        Colour slots are named after the colour they replace, so they can be
+        filled straight from a colour transformation dictionary.
 
+        Args:
+            source (str): Serialized SVG with slot markers
+        """
+        self.source = source
+        split = self.slot_pattern.split(source)
+        self.parts = split[0::2]
+        self.slots = split[1::2]
+
+    @classmethod
+    @profiler.stage
+    def compile(cls, svg_string: bytes, star_alpha: float) -> "SVGTemplate":
+        """
+        Compile a serialized SVG into a template
 
+        Args:
+            svg_string (bytes): Serialized SVG, e.g. the output of Canvas.dumps()
+            star_alpha (float): Fill opacity to turn into the alpha slot
+        """
+        root = XML(svg_string)
+        star_alpha = float(star_alpha)
+        for element,fields in index_styles(root):
+            for key,value in fields.items():
+                if cls.colour_pattern.fullmatch(value):
+                    fields[key] = f"@@{value.lower()}@@"
+                elif key == "fill-opacity" and parse_opacity(value) == star_alpha:
+                    fields[key] = f"@@{cls.alpha_slot}@@"
+            element.set("style",format_style(fields))
+
+        return cls(tostring(root,encoding="unicode"))
+
+    @profiler.stage
+    def render(self, transform_colour_dict: dict, target_alpha: float) -> bytes:
+        """
+        Fill in the template
 
+        Args:
+            transform_colour_dict (dict): Colour map, as in Canvas.transform_colours
+            target_alpha (float): Star alpha
 
+        Returns:
+            bytes: The SVG
+        """
+        values = {key.lower() : value for key,value in transform_colour_dict.items()}
+        values[self.alpha_slot] = f"{target_alpha}"
+
+        filled = [self.parts[0]]
+        for slot,part in zip(self.slots,self.parts[1:]):
+            filled.append(values.get(slot,slot))
+            filled.append(part)
+
+        return "".join(filled).encode()
+
+
+@profiler.stage
+def rasterize(svg_string: bytes, path: str, width: int, height: int) -> bytes:
+    """
+    Rasterize an SVG to a PNG at path, or return the PNG bytes if path is None
+    """
+    # cairosvg pulls in cairocffi and its CSS parsers, so it is imported on first render rather than at startup
+    import cairosvg as cairo
+    return cairo.svg2png(  bytestring=svg_string,
+                            write_to=path,
+                            parent_width=width,
+                            parent_height=height,
+                            scale=1)
+
+
+def rasterizer() -> str:
+    """
+    Name the rasterizer behind rasterize, so timings can be told apart from ones taken with another
+
+    Returns:
+        str: cairosvg and cairo versions, e.g. "cairosvg 2.7.1, cairo 1.18.0".
+        A version is "unknown" if the module doesn't report one (e.g. a stand-in cairosvg)
+    """
+    import cairosvg
+    try:
+        import cairocffi
+        cairo_version = cairocffi.cairo_version_string()
+    except (ImportError,OSError,AttributeError):
+        cairo_version = "unknown"
+    return f"cairosvg {getattr(cairosvg,'__version__','unknown')}, cairo {cairo_version}"
@@ -0,0 +1,356 @@
+import cache as ch
+import painter as p
+import profiler
+import svgmanip as svg
+import svgutils.compose as compose
+import re
+import os
+import json
+import argparse
+import numpy as np
+from lxml.etree import XML,tostring,cleanup_namespaces,_Comment,_ProcessingInstruction
+
+
+CACHE_DIR = "output/assets"
+
+# Version of what compile_asset produces, cached assets of any other version are compiled again
+FORMAT = 2
+
+SVG_NAMESPACE = "{http://www.w3.org/2000/svg}"
+
+# Namespaces only editors care about
+EDITOR_NAMESPACES = [
+    "http://www.inkscape.org/namespaces/inkscape",
+    "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd",
+    "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "http://creativecommons.org/ns#",
+    "http://purl.org/dc/elements/1.1/"
+]
+
+# CSS pixels per unit
+UNITS = {"px" : 1, "pt" : 4/3, "pc" : 16, "mm" : 96/25.4, "cm" : 96/2.54, "in" : 96}
+
+PATH_TOKEN = re.compile(r"[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?")
+TRANSFORM = re.compile(r"(matrix|translate|scale|rotate)\s*\(([^)]*)\)")
+
+# Number of parameters taken by each path command
+PATH_PARAMETERS = {"m" : 2, "l" : 2, "h" : 1, "v" : 1, "c" : 6, "s" : 4, "q" : 4, "t" : 2, "a" : 7, "z" : 0}
+
+MAGIC_COLOURS = set(p.Palette.magic.values())
+
+
+def parse_length(length: str) -> float:
+    """
+    Convert an SVG length, e.g. "4.06mm", to CSS pixels
+    """
+    number,unit = re.fullmatch(r"\s*([-+\d.eE]+)\s*([a-z]*)\s*",length).groups()
+    return float(number) * UNITS.get(unit or "px",1)
+
+
+def parse_transform(transform: str) -> np.ndarray:
+    """
+    Parse an SVG transform attribute into a 3x3 affine matrix
+    """
+    matrix = np.eye(3)
+    for name,arguments in TRANSFORM.findall(transform or ""):
+        values = [float(value) for value in re.split(r"[\s,]+",arguments.strip()) if value]
+        match name:
+            case "matrix":
+                a,b,c,d,e,f = values
+                step = np.array([[a,c,e],[b,d,f],[0,0,1]])
+            case "translate":
+                x,y = (values + [0])[:2]
+                step = np.array([[1,0,x],[0,1,y],[0,0,1]])
+            case "scale":
+                x,y = (values + values)[:2]
+                step = np.diag([x,y,1.0])
+            case "rotate":
+                angle,x,y = (values + [0,0])[:3]
+                cos,sin = np.cos(np.radians(angle)),np.sin(np.radians(angle))
+                step = np.array([[cos,-sin,x - cos*x + sin*y],[sin,cos,y - sin*x - cos*y],[0,0,1]])
+        matrix = matrix @ step
+    return matrix
+
+
+def parse_path(d: str) -> list:
+    """
+    Parse SVG path data into absolute segments
+
+    Returns:
+        list: (command, points) pairs, with upper case commands and absolute (x, y) points,
+        the end point last. Horizontal and vertical lines become "L", arcs keep their parameters as "A".
+    """
+    tokens = PATH_TOKEN.findall(d)
+    segments = []
+    x,y = 0.0,0.0
+    start = (0.0,0.0)
+    command = None
+    i = 0
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+        elif command is None:
+            raise ValueError(f"Path data doesn't start with a command : {d[:32]}")
+
+        relative = command.islower()
+        kind = command.lower()
+        count = PATH_PARAMETERS[kind]
+        values = [float(value) for value in tokens[i:i + count]]
+        i += count
+
+        dx,dy = (x,y) if relative else (0.0,0.0)
+
+        match kind:
+            case "z":
+                segments.append(("Z",[start]))
+                x,y = start
+                continue
+            case "h":
+                points = [(values[0] + dx,y)]
+                kind = "l"
+            case "v":
+                points = [(x,values[0] + dy)]
+                kind = "l"
+            case "a":
+                points = [(values[5] + dx,values[6] + dy)]
+                segments.append(("A",values[:5] + points))
+                x,y = points[-1]
+                continue
+            case _:
+                points = [(values[j] + dx,values[j + 1] + dy) for j in range(0,count,2)]
+
+        segments.append((kind.upper(),points))
+        x,y = points[-1]
+
+        if kind == "m":
+            start = (x,y)
+            # Coordinates following a move are implicit lines
+            command = "l" if relative else "L"
+
+    return segments
+
+
+def path_points(segments: list) -> np.ndarray:
+    """
+    Every end and control point of a parsed path, as an Nx2 array. Their bounding box contains the path.
+    """
+    points = []
+    for command,values in segments:
+        if command == "A":
+            rx,ry = abs(values[0]),abs(values[1])
+            x,y = values[-1]
+            points.extend([(x - rx,y - ry),(x + rx,y + ry)])
+        else:
+            points.extend(values)
+    return np.array(points,dtype=float).reshape(-1,2)
+
+
+def bounding_box(root, matrix: np.ndarray = None) -> list:
+    """
+    Bounding box of every path under an element, in the element's user units
+
+    Returns:
+        list: [x0, y0, x1, y1], or None if there are no paths
+    """
+    if matrix is None:
+        matrix = np.eye(3)
+    matrix = matrix @ parse_transform(root.get("transform"))
+
+    boxes = []
+    if root.tag == f"{SVG_NAMESPACE}path" and root.get("d"):
+        points = path_points(parse_path(root.get("d")))
+        if len(points):
+            points = points @ matrix[:2,:2].T + matrix[:2,2]
+            boxes.append([*points.min(axis=0),*points.max(axis=0)])
+
+    for child in root.iterchildren(f"{SVG_NAMESPACE}*"):
+        box = bounding_box(child,matrix)
+        if box is not None:
+            boxes.append(box)
+
+    if not boxes:
+        return None
+    boxes = np.array(boxes)
+    return [*boxes[:,:2].min(axis=0).tolist(),*boxes[:,2:].max(axis=0).tolist()]
+
+
+def strip_cruft(root) -> None:
+    """
+    Remove comments, editor metadata and namespaces, unreferenced ids and empty definitions
+    from an element tree, and collapse whitespace in path data, in place.
+    Whitespace between elements is kept, as it stops the canvas being reindented when pretty printed.
+    """
+    text = tostring(root,encoding="unicode")
+    referenced = set(re.findall(r"url\(#([^)]+)\)",text)) | set(re.findall(r"href=\"#([^\"]+)\"",text))
+
+    for element in list(root.iter()):
+        if isinstance(element,(_Comment,_ProcessingInstruction)) or \
+           any(element.tag.startswith(f"{{{namespace}}}") for namespace in EDITOR_NAMESPACES) or \
+           element.tag == f"{SVG_NAMESPACE}metadata":
+            element.getparent().remove(element)
+            continue
+
+        for attribute in list(element.attrib):
+            if any(attribute.startswith(f"{{{namespace}}}") for namespace in EDITOR_NAMESPACES) or \
+               (attribute == "id" and element.get("id") not in referenced):
+                del element.attrib[attribute]
+
+        if "d" in element.attrib:
+            element.set("d"," ".join(element.get("d").split()))
+
+    for defs in list(root.iter(f"{SVG_NAMESPACE}defs")):
+        if len(defs) == 0:
+            defs.getparent().remove(defs)
+
+    cleanup_namespaces(root)
+
+
+class Asset:
+
+    def __init__(self,
+                 source: str,
+                 mtime: float,
+                 digest: str,
+                 width: float,
+                 height: float,
+                 bbox: list,
+                 colours: list,
+                 content: str) -> None:
+        """
+        A preprocessed SVG asset
+
+        Args:
+            source (str): Path of the source SVG
+            mtime (float): Modification time of the source when it was compiled
+            digest (str): SHA-256 of the source
+            width (float): Width in user units, converted from the source's units, which layouts are worked out from
+            height (float): Height in user units
+            bbox (list): [x0, y0, x1, y1] bounding box of the drawing, in user units
+            colours (list): Magic colours the drawing uses
+            content (str): Cleaned SVG group holding the drawing
+        """
+        self.source = source
+        self.mtime = mtime
+        self.digest = digest
+        self.width = width
+        self.height = height
+        self.bbox = bbox
+        self.colours = colours
+        self.content = content
+
+    def __repr__(self) -> str:
+        return f"Asset({self.source}, {self.width}x{self.height}, {len(self.content)} bytes, colours={self.colours})"
+
+    def element(self) -> svg.Element:
+        """
+        A fresh svgmanip element of the asset, equivalent to svg.Element(source)
+        """
+        return svg.Element(self.width,self.height,compose.Element(XML(self.content)))
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, fields: dict) -> "Asset":
+        return cls(**fields)
+
+
+@profiler.stage
+def compile_asset(path: str) -> Asset:
+    """
+    Parse and normalize an SVG asset
+
+    Args:
+        path (str): Path of the SVG
+
+    Returns:
+        Asset: Preprocessed asset
+    """
+    element = svg.Element(path)
+    content = element.root[0]
+    strip_cruft(content)
+
+    with open(path,"rb") as file:
+        source = XML(file.read())
+    # svgmanip truncates lengths with units (4 for "4.06mm"), so the size is worked out here
+    width,height = parse_length(source.get("width",f"{element.width}")),parse_length(source.get("height",f"{element.height}"))
+    if source.get("viewBox"):
+        # Children are drawn in viewBox units
+        width,height = [float(value) for value in re.split(r"[\s,]+",source.get("viewBox").strip())[2:]]
+
+    colours = set()
+    for styled in content.iter():
+        if isinstance(styled.tag,str):
+            for value in re.findall(r"#[0-9a-fA-F]{6}\b|#[0-9a-fA-F]{3}\b",styled.get("style","") + styled.get("fill","") + styled.get("stroke","")):
+                colours.add(value.lower())
+
+    return Asset(source=path,
+                 mtime=os.path.getmtime(path),
+                 digest=ch.file_digest(path),
+                 width=width,
+                 height=height,
+                 bbox=bounding_box(content),
+                 colours=sorted(colours & MAGIC_COLOURS),
+                 content=tostring(content,encoding="unicode"))
+
+
+@profiler.stage
+def load(path: str, cache_dir: str = CACHE_DIR) -> Asset:
+    """
+    Load an SVG asset from the asset cache, compiling it if the cache is missing or stale.
+    The cache is trusted while the source's mtime is unchanged; otherwise its hash decides.
+
+    Args:
+        path (str): Path of the SVG
+        cache_dir (str): Directory of the asset cache, None to always compile
+
+    Returns:
+        Asset: Preprocessed asset
+    """
+    if cache_dir is None:
+        return compile_asset(path)
+
+    cached = os.path.join(cache_dir,f"{ch.digest(os.path.abspath(path).encode())[:16]}.json")
+    mtime = os.path.getmtime(path)
+
+    if os.path.exists(cached):
+        with open(cached) as file:
+            fields = json.load(file)
+        # Entries compiled by another version of compile_asset are compiled again
+        if fields.pop("format",None) == FORMAT:
+            asset = Asset.from_dict(fields)
+            if asset.mtime == mtime:
+                return asset
+            if asset.digest == ch.file_digest(path):
+                asset.mtime = mtime
+                store(asset,cached)
+                return asset
+
+    asset = compile_asset(path)
+    store(asset,cached)
+    return asset
+
+
+def store(asset: Asset, path: str) -> None:
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    # Workers may compile the same asset at once, so never share the temporary file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary,"w") as file:
+        json.dump(dict(asset.to_dict(),format=FORMAT),file,separators=(",",":"))
+    os.replace(temporary,path)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Precompile SVG assets into the asset cache")
+    parser.add_argument("paths",nargs="*",default=None,help="Defaults to every constellation and the star")
+    parser.add_argument("--cache-dir",default=CACHE_DIR)
+    args = parser.parse_args()
+
+    paths = args.paths or [os.path.join("resources/constellations",name) for name in sorted(os.listdir("resources/constellations"))] + ["resources/star.svg"]
+
+    for path in paths:
+        asset = load(path,args.cache_dir)
+        print(f"{path} : {os.path.getsize(path)} -> {len(asset.content)} bytes, bbox {asset.bbox}, colours {asset.colours}")
@@ -0,0 +1,302 @@
+import artist as a
+import assets
+import painter as p
+import schedule as s
+import main
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from copy import deepcopy
+from functools import partial
+from datetime import datetime
+
+
+RESOLUTIONS = {
+    "1080p"     : (1920,1080),
+    "3440x1440" : (3440,1440),
+    "4k"        : (3840,2160),
+    "8k"        : (7680,4320)
+}
+
+STAR_COUNTS = [50,500,5000,50000]
+
+PALETTE = "palettes/kanagawa.yml"
+
+# Slow to import and only needed by some runs, so importing main must not import them
+LAZY_MODULES = ["requests","yaml","tomllib","cairosvg","PIL","compositor","tiler","animator","stamper"]
+
+# Most seconds importing main may take
+STARTUP_BUDGET = 0.5
+
+
+def measure(function, repeat: int = 3) -> dict:
+    """
+    Time a function and record its peak traced memory.
+    Memory is traced in a separate run, so tracing overhead doesn't skew the timings.
+    Only allocations made through Python's allocators (including NumPy's) are traced, not lxml's or cairo's.
+
+    Args:
+        function (callable): Function to benchmark, called without arguments
+        repeat (int): Number of timed runs
+
+    Returns:
+        dict: Best and mean wall time in seconds, and the peak memory allocated during a run in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "seconds"       : min(times),
+        "mean_seconds"  : sum(times) / len(times),
+        "peak_bytes"    : peak,
+        "repeat"        : repeat
+    }
+
+
+def import_time(module: str = "main", repeat: int = 3) -> dict:
+    """
+    Measure the import time of a module in a fresh interpreter, as reported by python -X importtime
+
+    Args:
+        module (str): Module to import
+        repeat (int): Number of fresh interpreters to import it in
+
+    Returns:
+        dict: Best and mean import time in seconds, and the modules the import pulled in
+    """
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable,"-X","importtime","-c",f"import {module}"],
+                                capture_output=True,text=True,check=True)
+        imported = {}
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _,cumulative,name = line.split("|")
+                if cumulative.strip().isdigit():
+                    imported[name.strip()] = int(cumulative) / 1e6
+        times.append(imported[module])
+
+    return {
+        "seconds"       : min(times),
+        "mean_seconds"  : sum(times) / len(times),
+        "peak_bytes"    : 0,
+        "repeat"        : repeat,
+        "modules"       : sorted(imported)
+    }
+
+
+def draw_canvas(width: int, height: int, star_count: int, star_mode: str = "instance", tolerance: float = 0) -> a.Canvas:
+    return main.draw(width,
+                     height,
+                     scale_factor=0.7,
+                     star_count=star_count,
+                     star_alpha=0.5,
+                     constellation="canis-major",
+                     star_mode=star_mode,
+                     seed=0,
+                     tolerance=tolerance)
+
+
+def setup_draw(count: int, star_mode: str = "instance"):
+    return lambda: draw_canvas(3440,1440,count,star_mode)
+
+
+def setup_recolour(count: int, stage: str, transform: dict):
+    canvas = draw_canvas(3440,1440,count)
+    canvas.dumps()
+
+    match stage:
+        case "transform_colours":
+            return lambda: canvas.transform_colours(transform)
+        case "transform_alpha":
+            return lambda: canvas.transform_alpha(0.5,0.5)
+        case "deepcopy":
+            return lambda: deepcopy(canvas)
+        case "template_render":
+            template = canvas.compile(0.5)
+            return lambda: template.render(transform,0.3)
+
+
+def setup_export(width: int, height: int, tolerance: float = 0):
+    canvas = draw_canvas(width,height,50,tolerance=tolerance)
+    path = os.path.join(tempfile.mkdtemp(),"benchmark.png")
+    return lambda: canvas.export(path)
+
+
+def setup_animate(count: int, transform: dict):
+    import animator as an
+
+    scene = main.Scene(0.7,count,0.5,"canis-major",seed=0)
+    animation = an.Animator(scene,scene.draw(3440,1440),seed=0)
+    animation.prepare(transform)
+    alphas = 0.5 * an.twinkle_curves(len(animation.stars),1,seed=0)[0]
+    return lambda: animation.frame(alphas)
+
+
+def setup_stamp(count: int):
+    import stamper as st
+
+    scene = main.Scene(0.7,count,0.5,"canis-major",seed=0)
+    canvas = scene.draw(3440,1440,stars=False)
+    return partial(st.StarStamper(scene).stamp,canvas)
+
+
+def benchmarks(quick: bool = False) -> dict:
+    """
+    Build the benchmark suite. Setup is deferred, so filtered out benchmarks cost nothing.
+
+    Returns:
+        dict: {name : (setup, repeat)}, where setup() returns the function to time
+    """
+    repeat = 1 if quick else 3
+    star_counts = STAR_COUNTS[:3] if quick else STAR_COUNTS
+    resolutions = {key : RESOLUTIONS[key] for key in ["1080p","3440x1440"]} if quick else RESOLUTIONS
+
+    colours = {"bgr_lum" : 0.1, "fil_lum" : 0.6, "str_lum" : 0.7}
+    transform = p.Palette(PALETTE,**colours).create_transform()
+    schedule = s.ColourSchedule(51.5,0)
+
+    suite = {}
+
+    for count in star_counts:
+        suite[f"draw/instance/{count}"] = (partial(setup_draw,count),repeat)
+    for count in star_counts[:2]:
+        suite[f"draw/copy/{count}"] = (partial(setup_draw,count,"copy"),repeat)
+
+    for count in star_counts[:3]:
+        for stage in ["transform_colours","transform_alpha","deepcopy","template_render"]:
+            suite[f"{stage}/{count}"] = (partial(setup_recolour,count,stage,transform),repeat)
+
+    suite["palette/init"] = (lambda: lambda: p.Palette(PALETTE,**colours),repeat * 10)
+    suite["palette/create_transform"] = (lambda: p.Palette(PALETTE,**colours).create_transform,repeat * 10)
+    suite["palette/table"] = (lambda: lambda: p.PaletteTable(PALETTE,schedule.schedule),repeat * 10)
+
+    constellation = "resources/constellations/canis-major.svg"
+    suite["assets/compile"] = (lambda: partial(assets.compile_asset,constellation),repeat * 10)
+    suite["assets/load"] = (lambda: partial(assets.load,constellation,tempfile.mkdtemp()),repeat * 10)
+
+    suite["schedule/init"] = (lambda: lambda: s.ColourSchedule(51.5,0),repeat * 10)
+    suite["schedule/table_build"] = (lambda: partial(s.ScheduleTable.build,51.5,0,2026),repeat * 10)
+    suite["schedule/table_lookup"] = (lambda: partial(s.ScheduleTable.build(51.5,0,2026).colours,datetime(2026,6,21,13)),repeat * 10)
+
+    for count in star_counts:
+        suite[f"stamp/{count}"] = (partial(setup_stamp,count),repeat)
+
+    for count in star_counts[:2]:
+        suite[f"animate/frame/{count}"] = (partial(setup_animate,count,transform),repeat)
+
+    for name,(width,height) in resolutions.items():
+        suite[f"export/{name}"] = (partial(setup_export,width,height),repeat)
+        suite[f"export/{name}/lod"] = (partial(setup_export,width,height,0.25),repeat)
+
+    return suite
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare results against a baseline
+
+    Args:
+        results (dict): Current results
+        baseline (dict): Baseline results
+        tolerance (float): Allowed relative slowdown or memory growth, e.g. 0.25 for 25%
+
+    Returns:
+        list: (name, metric, baseline, current) for every regression
+    """
+    regressions = []
+    for name,current in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        previous = baseline["benchmarks"][name]
+        for metric in ["seconds","peak_bytes"]:
+            if previous[metric] > 0 and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append((name,metric,previous[metric],current[metric]))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the drawing, recolouring, palette, schedule and export hot paths")
+
+    parser.add_argument("-o","--output",default="output/benchmark.json")
+    parser.add_argument("-b","--baseline",default="benchmark-baseline.json")
+    parser.add_argument("--save-baseline",action="store_true")
+    parser.add_argument("-t","--tolerance",default=0.25,type=float)
+    parser.add_argument("-k","--filter",default="",help="Only run benchmarks whose name contains this")
+    parser.add_argument("-q","--quick",action="store_true")
+    parser.add_argument("--startup-budget",default=STARTUP_BUDGET,type=float,help="Maximum import time of main.py in seconds")
+
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    results = {
+        "python"    : platform.python_version(),
+        "machine"   : platform.machine(),
+        "processor" : platform.processor(),
+        "rasterizer": a.rasterizer(),
+        "benchmarks": {}
+    }
+
+    failures = []
+
+    if args.filter in "startup/import_main":
+        result = import_time("main",1 if args.quick else 5)
+        modules = result.pop("modules")
+        eager = [module for module in LAZY_MODULES if module in modules]
+        results["benchmarks"]["startup/import_main"] = result
+        print(f"{'startup/import_main':<32}{result['seconds']*1000:>12.2f} ms")
+
+        if result["seconds"] > args.startup_budget:
+            failures.append(f"STARTUP importing main took {result['seconds']:.3f}s, over the {args.startup_budget:.3f}s budget")
+        if eager:
+            failures.append(f"STARTUP importing main imported {', '.join(eager)}, which should be imported on first use")
+
+    for name,(setup,repeat) in benchmarks(args.quick).items():
+        if args.filter not in name:
+            continue
+        results["benchmarks"][name] = measure(setup(),repeat)
+        result = results["benchmarks"][name]
+        print(f"{name:<32}{result['seconds']*1000:>12.2f} ms{result['peak_bytes']/1024**2:>12.2f} MB")
+
+    os.makedirs(os.path.dirname(args.output) or ".",exist_ok=True)
+    with open(args.output,"w") as file:
+        json.dump(results,file,indent=4,sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline,"w") as file:
+            json.dump(results,file,indent=4,sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        regressions = compare(results,baseline,args.tolerance)
+        for name,metric,previous,current in regressions:
+            failures.append(f"REGRESSION {name} {metric} : {previous:.6g} -> {current:.6g}")
+
+        if not regressions:
+            print(f"No regressions against {args.baseline}")
+
+    for failure in failures:
+        print(failure)
+
+    if failures:
+        sys.exit(1)
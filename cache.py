@@ -0,0 +1,187 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    with open(path,"rb") as file:
+        return digest(file.read())
+
+
+class RenderCache:
+
+    def __init__(self,
+                 directory: str = "output/cache",
+                 max_bytes: int = 256 * 1024**2,
+                 suffix: str = ".png") -> None:
+        """
+        Content-addressed on-disk cache of rendered wallpapers, evicted least recently used first
+        once the cache grows beyond max_bytes. Recency survives restarts through file mtimes.
+
+        Args:
+            directory (str): Directory to keep cached files in
+            max_bytes (int): Size bound of the cache
+            suffix (str): File extension of cached files
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory,exist_ok=True)
+
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(suffix):
+                stat = os.stat(os.path.join(directory,name))
+                entries.append((stat.st_mtime,name[:-len(suffix)],stat.st_size))
+
+        self.entries = OrderedDict((key,size) for _,key,size in sorted(entries))
+        self.size = sum(self.entries.values())
+
+    def __repr__(self) -> str:
+        return f"{self.stats()}"
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Hash everything a render depends on into a cache key
+
+        Args:
+            parts: JSON serializable render inputs, e.g. SVG digest, palette digest, colour map, star alpha
+
+        Returns:
+            str: Cache key
+        """
+        return digest(json.dumps(parts,sort_keys=True).encode())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory,f"{key}{self.suffix}")
+
+    def get(self, key: str) -> str:
+        """
+        Look up a render
+
+        Returns:
+            str: Path to the cached file, or None on a miss
+        """
+        if key not in self.entries or not os.path.exists(self.path(key)):
+            self.entries.pop(key,None)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        os.utime(self.path(key))
+        return self.path(key)
+
+    def store(self, key: str, source: str) -> str:
+        """
+        Copy a rendered file into the cache
+
+        Args:
+            key (str): Cache key
+            source (str): Path of the rendered file
+
+        Returns:
+            str: Path to the cached file
+        """
+        target = self.path(key)
+        temporary = f"{target}.tmp"
+        shutil.copyfile(source,temporary)
+        os.replace(temporary,target)
+
+        self.size -= self.entries.pop(key,0)
+        self.entries[key] = os.path.getsize(target)
+        self.size += self.entries[key]
+        self.evict(keep=key)
+
+        return target
+
+    def evict(self, keep: str = None) -> None:
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            key,size = next(iter(self.entries.items()))
+            if key == keep:
+                break
+            del self.entries[key]
+            self.size -= size
+            self.evictions += 1
+            if os.path.exists(self.path(key)):
+                os.remove(self.path(key))
+
+    def stats(self) -> dict:
+        return {
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            "evictions" : self.evictions,
+            "entries"   : len(self.entries),
+            "bytes"     : self.size
+        }
+
+
+class MemoryCache:
+
+    def __init__(self, max_bytes: int = 64 * 1024**2) -> None:
+        """
+        Thread-safe in-memory cache of rendered wallpapers, evicted least recently used first
+        once it holds more than max_bytes
+
+        Args:
+            max_bytes (int): Size bound of the cache
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self) -> str:
+        return f"{self.stats()}"
+
+    def get(self, key: str) -> bytes:
+        """
+        Look up a render
+
+        Returns:
+            bytes: The cached data, or None on a miss
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def store(self, key: str, data: bytes) -> None:
+        with self.lock:
+            self.size -= len(self.entries.pop(key,b""))
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _,evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits"      : self.hits,
+                "misses"    : self.misses,
+                "evictions" : self.evictions,
+                "entries"   : len(self.entries),
+                "bytes"     : self.size
+            }
@@ -0,0 +1,267 @@
+import artist as a
+import painter as p
+import profiler
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+
+LAYERS = ["background","detail","foreground"]
+
+MAGIC_COLOURS = list(p.Palette.magic.values())
+
+
+def hex_to_rgb(colour: str) -> np.ndarray:
+    colour = colour.lstrip("#")
+    if len(colour) == 3:
+        colour = "".join(digit * 2 for digit in colour)
+    return np.array([int(colour[i:i+2],16) for i in (0,2,4)],dtype=np.float32) / 255
+
+
+def decode_png(png: bytes) -> np.ndarray:
+    return np.asarray(Image.open(BytesIO(png)).convert("RGBA"))
+
+
+def box_widths(sigma: float, passes: int = 3) -> list:
+    """
+    Odd widths of the box blurs that, applied in turn, approximate a gaussian blur of a given standard deviation
+    """
+    ideal = np.sqrt(12 * sigma**2 / passes + 1)
+    lower = int(ideal) - (1 - int(ideal) % 2)
+    upper = lower + 2
+    count = round((12 * sigma**2 - passes * lower**2 - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    return [lower if i < count else upper for i in range(passes)]
+
+
+def box_blur(plane: np.ndarray, width: int, axis: int) -> np.ndarray:
+    """
+    Mean over a window of an odd width along an axis, from running sums, so its cost doesn't depend on the width.
+    Everything outside the plane counts as zero.
+    """
+    radius = width // 2
+    padding = [(radius + 1,radius) if dimension == axis else (0,0) for dimension in range(plane.ndim)]
+    sums = np.cumsum(np.pad(plane,padding),axis=axis,dtype=np.float32)
+    length = plane.shape[axis]
+    upper = np.take(sums,np.arange(width,width + length),axis=axis)
+    lower = np.take(sums,np.arange(0,length),axis=axis)
+    return (upper - lower) / width
+
+
+@profiler.stage
+def gaussian_blur(plane: np.ndarray, sigma: float, passes: int = 3) -> np.ndarray:
+    """
+    Separable approximate gaussian blur: repeated box blurs along each axis
+    """
+    for width in box_widths(sigma,passes):
+        for axis in (0,1):
+            plane = box_blur(plane,width,axis)
+    return plane
+
+
+class LayerMasks:
+
+    def __init__(self, coverage: np.ndarray, masks: dict) -> None:
+        """
+        Rasterized layer, split into one coverage mask per magic colour.
+
+        Args:
+            coverage (np.ndarray): Total (premultiplied) alpha of the layer, HxW uint8
+            masks (dict): {magic colour : HxW uint8 premultiplied contribution of that colour}
+        """
+        self.coverage = coverage
+        self.masks = masks
+
+    @property
+    def nbytes(self) -> int:
+        return self.coverage.nbytes + sum(mask.nbytes for mask in self.masks.values())
+
+    def colour(self, transform_colour_dict: dict) -> tuple:
+        """
+        Recolour the layer
+
+        Args:
+            transform_colour_dict (dict): Colour map, as in Canvas.transform_colours
+
+        Returns:
+            tuple: HxWx3 premultiplied RGB (0->1) and HxW coverage, as float32
+        """
+        rgb = np.zeros(self.coverage.shape + (3,),dtype=np.float32)
+        for magic,mask in self.masks.items():
+            rgb += mask[...,None].astype(np.float32) / 255 * hex_to_rgb(transform_colour_dict.get(magic,magic))
+        return rgb,self.coverage.astype(np.float32) / 255
+
+
+@profiler.stage
+def rasterize_masks(svg_string: bytes, width: int, height: int, star_alpha: float, opaque_stars: bool = False) -> LayerMasks:
+    """
+    Rasterize an SVG into one coverage mask per magic colour.
+
+    Each magic colour is rendered white, with every other colour black,
+    so the red channel of that render is exactly the colour's share of each pixel
+    after antialiasing and overlaps.
+
+    Args:
+        svg_string (bytes): Serialized SVG, e.g. a layer of a canvas
+        width (int): Width to rasterize at
+        height (int): Height to rasterize at
+        star_alpha (float): Star alpha the SVG was drawn with
+        opaque_stars (bool): Render stars opaque, to fade them later
+    """
+    template = a.SVGTemplate.compile(svg_string,star_alpha)
+    alpha = 1 if opaque_stars else star_alpha
+
+    used = {slot for slot in template.slots if slot in MAGIC_COLOURS}
+
+    coverage = np.zeros((height,width),dtype=np.uint8)
+    masks = {}
+    for colour in sorted(used):
+        transform = {magic : "#ffffff" if magic == colour else "#000000" for magic in MAGIC_COLOURS}
+        target = template.render(transform,alpha)
+        pixels = decode_png(a.rasterize(target,None,width,height)).astype(np.uint16)
+
+        coverage = pixels[...,3].astype(np.uint8)
+        masks[colour] = ((pixels[...,0] * pixels[...,3] + 127) // 255).astype(np.uint8)
+
+    return LayerMasks(coverage,masks)
+
+
+class Compositor:
+
+    def __init__(self,
+                 canvas: a.Canvas,
+                 star_alpha: float,
+                 glow: float = 0,
+                 glow_strength: float = 1,
+                 glow_layers: tuple = ("detail","foreground"),
+                 detail: LayerMasks = None) -> None:
+        """
+        Rasterize every layer of a drawn canvas once, so that recolouring it
+        is a weighted sum of cached masks (see rasterize_masks) instead of a full SVG render.
+        Stars are rendered opaque and faded at composite time.
+
+        Glow is added light: a blurred copy of a layer on top of it. Blurring is linear, so it
+        is applied to each colour's mask once and recolours like the masks do, at no cost per composite.
+
+        Args:
+            canvas (a.Canvas): Drawn canvas
+            star_alpha (float): Star alpha the canvas was drawn with
+            glow (float): Standard deviation of the glow in pixels, 0 for none
+            glow_strength (float): Brightness of the glow, relative to the layer
+            glow_layers (tuple): Layers that glow
+            detail (LayerMasks): Detail layer rasterized elsewhere, e.g. by stamper.StarStamper, instead of from the canvas
+        """
+        self.width = canvas.width
+        self.height = canvas.height
+        self.star_alpha = star_alpha
+        self.glow = glow
+        self.glow_strength = glow_strength
+        self.glow_layers = glow_layers
+        self.layers = {layer : self.rasterize_layer(canvas,layer) for layer in LAYERS if layer != "detail" or detail is None}
+        if detail is not None:
+            self.layers["detail"] = detail
+        self.weights,self.coverage = self.linearize()
+
+    @profiler.stage
+    def rasterize_layer(self, canvas: a.Canvas, layer: str) -> LayerMasks:
+        return rasterize_masks(canvas.dumps_layer(layer),self.width,self.height,self.star_alpha,opaque_stars=layer == "detail")
+
+    @profiler.stage
+    def linearize(self) -> tuple:
+        """
+        Fold the layers into one pair of weight planes per magic colour.
+
+        Only the detail layer's opacity varies (with the star alpha), and nothing beneath it does,
+        so premultiplied source-over of the layers is linear in the star alpha: every magic colour
+        contributes (constant + star alpha * slope) of itself to each pixel, and the same goes for coverage.
+
+        Returns:
+            tuple: {magic colour : (constant, slope)} and the (constant, slope) of the coverage, as HxW float32 planes
+        """
+        shape = (self.height,self.width)
+        weights = {}
+        coverage = (np.zeros(shape,dtype=np.float32),np.zeros(shape,dtype=np.float32))
+
+        for layer in LAYERS:
+            masks = self.layers[layer]
+            if not masks.masks:
+                continue
+
+            layer_coverage = masks.coverage.astype(np.float32) / 255
+            variable = layer == "detail"
+
+            # Source-over with an opacity of 1, or of the star alpha, which moves the layer into the slope
+            planes = list(weights.values()) + [coverage]
+            for constant,slope in planes:
+                if variable:
+                    slope -= constant * layer_coverage
+                else:
+                    constant *= 1 - layer_coverage
+                    slope *= 1 - layer_coverage
+
+            glowing = self.glow > 0 and layer in self.glow_layers
+
+            coverage[1 if variable else 0][...] += layer_coverage
+            if glowing:
+                coverage[1 if variable else 0][...] += self.glow_strength * gaussian_blur(layer_coverage,self.glow)
+
+            for magic,mask in masks.masks.items():
+                constant,slope = weights.setdefault(magic,(np.zeros(shape,dtype=np.float32),np.zeros(shape,dtype=np.float32)))
+                share = mask.astype(np.float32) / 255
+                (slope if variable else constant)[...] += share
+                if glowing:
+                    (slope if variable else constant)[...] += self.glow_strength * gaussian_blur(share,self.glow)
+
+        return weights,coverage
+
+    @property
+    def nbytes(self) -> int:
+        planes = [plane for pair in list(self.weights.values()) + [self.coverage] for plane in pair]
+        return sum(layer.nbytes for layer in self.layers.values()) + sum(plane.nbytes for plane in planes)
+
+    @profiler.stage
+    def composite(self, transform_colour_dict: dict, target_alpha: float) -> np.ndarray:
+        """
+        Composite the cached layers with a colour transformation and star alpha
+
+        Args:
+            transform_colour_dict (dict): Colour map, as in Canvas.transform_colours
+            target_alpha (float): Star alpha
+
+        Returns:
+            np.ndarray: HxWx4 RGBA image
+        """
+        alpha = np.float32(target_alpha)
+
+        # Magic colours mapped to the same colour share one weight plane
+        groups = {}
+        for magic,(constant,slope) in self.weights.items():
+            colour = transform_colour_dict.get(magic,magic)
+            weight = constant + alpha * slope
+            if colour in groups:
+                groups[colour] += weight
+            else:
+                groups[colour] = weight
+
+        # Glow can add up to more than full coverage
+        coverage = np.minimum(self.coverage[0] + alpha * self.coverage[1],1)
+        opaque = coverage.min() >= 1 - 1e-6
+
+        image = np.empty((self.height,self.width,4),dtype=np.uint8)
+        channel = np.empty((self.height,self.width),dtype=np.float32)
+        for index in range(3):
+            channel.fill(0.5)
+            for colour,weight in groups.items():
+                value = hex_to_rgb(colour)[index] * 255
+                if value > 0:
+                    channel += weight * value
+            if not opaque:
+                # Un-premultiply
+                np.divide(channel - 0.5,coverage,out=channel,where=coverage > 0)
+                channel += 0.5
+            image[...,index] = np.clip(channel,0,255)
+        image[...,3] = np.clip(coverage * 255 + 0.5,0,255)
+        return image
+
+    @profiler.stage
+    def export(self, transform_colour_dict: dict, target_alpha: float, path: str, compress_level: int = 6) -> None:
+        Image.fromarray(self.composite(transform_colour_dict,target_alpha),"RGBA").save(path,"PNG",compress_level=compress_level)
@@ -0,0 +1,209 @@
+import artist as a
+import cache as ch
+import schedule as s
+import worker as w
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor,as_completed
+
+
+def settings_digest(settings: dict, hour: int) -> str:
+    """
+    Digest of the shared settings a job's render depends on, with its hour's colours in place of the whole schedule
+    """
+    shared = {key : value for key,value in settings.items() if key != "schedule"}
+    return ch.RenderCache.key(shared,settings["schedule"][hour])
+
+
+def render_job(constellation: str, palette: str, hour: int, path: str) -> dict:
+    """
+    Render one constellation, palette and hour. The PNG is written next to
+    its final path and moved into place, so a finished file is always complete.
+
+    Returns:
+        dict: Manifest entry for the job
+    """
+    start = time.perf_counter()
+
+    width,height = w.settings["width"],w.settings["height"]
+    template = w.load_template(constellation,width,height)
+    transform = w.load_palettes(palette).create_transform(hour)
+    target_alpha = w.settings["schedule"][hour]["star_al"]
+
+    temporary = f"{path}.tmp"
+    a.rasterize(template.render(transform,target_alpha),temporary,width,height)
+    os.replace(temporary,path)
+
+    return {
+        "constellation" : constellation,
+        "palette"       : palette,
+        "hour"          : hour,
+        "path"          : path,
+        "status"        : "rendered",
+        "settings"      : settings_digest(w.settings,hour),
+        "seconds"       : time.perf_counter() - start
+    }
+
+
+def job_matrix(constellations: list, palettes: list, hours: list, output_dir: str) -> list:
+    """
+    Every (constellation, palette, hour, path) combination, grouped by constellation
+    so consecutive jobs reuse the same parsed scene
+    """
+    jobs = []
+    for constellation in constellations:
+        for palette in palettes:
+            directory = os.path.join(output_dir,constellation,os.path.splitext(palette)[0])
+            os.makedirs(directory,exist_ok=True)
+            for hour in hours:
+                jobs.append((constellation,palette,hour,os.path.join(directory,f"constellation_{hour}.png")))
+    return jobs
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Entries of the manifest by path, with the journal of an interrupted run replayed on top
+
+    Returns:
+        dict: {path : manifest entry}
+    """
+    entries = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            entries = {entry["path"] : entry for entry in json.load(file)["jobs"]}
+
+    journal = f"{manifest_path}.journal"
+    if os.path.exists(journal):
+        with open(journal) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line of a run killed mid-write
+                    continue
+                entries[entry["path"]] = entry
+
+    return entries
+
+
+def run(jobs: list, settings: dict, workers: int = 1, manifest_path: str = None) -> dict:
+    """
+    Render every job that doesn't have an output yet, or whose output was rendered with other settings
+    (see settings_digest), across a pool of worker processes.
+
+    Finished jobs are appended to a journal next to the manifest as they complete, so an interrupted run
+    resumes from its last finished job. The manifest keeps the entries of earlier runs over other jobs,
+    so runs over subsets add up.
+
+    Args:
+        jobs (list): (constellation, palette, hour, path) tuples, see job_matrix
+        settings (dict): Shared render settings, sent to every worker once (see worker.init)
+        workers (int): Number of worker processes
+        manifest_path (str): Manifest to resume from and write to
+
+    Returns:
+        dict: The manifest
+    """
+    entries = load_manifest(manifest_path) if manifest_path is not None else {}
+
+    pending = []
+    stale = 0
+    for constellation,palette,hour,path in jobs:
+        done = os.path.exists(path)
+        if done and entries.get(path,{}).get("settings") != settings_digest(settings,hour):
+            # Rendered with other settings, or by a run that didn't record them
+            done = False
+            stale += 1
+        if done:
+            entries[path] = dict(entries[path],status="skipped")
+        else:
+            pending.append((constellation,palette,hour,path))
+
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {stale} rendered with other settings, rendering {len(pending)}")
+
+    start = time.perf_counter()
+    journal = open(f"{manifest_path}.journal","a") if manifest_path is not None else None
+
+    def finish(done: int, entry: dict) -> None:
+        entries[entry["path"]] = entry
+        if journal is not None:
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+        print(f"[{done}/{len(pending)}] {entry['path']} in {entry['seconds']:.2f}s")
+
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=w.init,
+                                     initargs=(settings,)) as pool:
+                futures = [pool.submit(render_job,*job) for job in pending]
+                for done,future in enumerate(as_completed(futures),1):
+                    finish(done,future.result())
+        else:
+            w.init(settings)
+            for done,job in enumerate(pending,1):
+                finish(done,render_job(*job))
+    finally:
+        if journal is not None:
+            journal.close()
+
+    manifest = {
+        "settings"      : {key : value for key,value in settings.items() if key != "schedule"},
+        "wall_seconds"  : time.perf_counter() - start,
+        "rendered"      : len(pending),
+        "skipped"       : len(jobs) - len(pending),
+        "jobs"          : list(entries.values())
+    }
+
+    if manifest_path is not None:
+        # Written next to the manifest and moved into place, then the journal it includes can go
+        temporary = f"{manifest_path}.tmp"
+        with open(temporary,"w") as file:
+            json.dump(manifest,file,indent=4)
+        os.replace(temporary,manifest_path)
+        os.remove(f"{manifest_path}.journal")
+
+    return manifest
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Render every constellation x palette x hour, resuming where a previous run stopped")
+
+    parser.add_argument("-c","--constellations",nargs="*",default=None,help="Defaults to every constellation in resources/constellations")
+    parser.add_argument("-p","--palettes",nargs="*",default=None,help="Defaults to every palette in palettes/")
+    parser.add_argument("--hours",nargs="*",default=list(range(24)),type=int)
+    parser.add_argument("--width",default=3440,type=int)
+    parser.add_argument("--height",default=1440,type=int)
+    parser.add_argument("-s","--scale",default=0.7,type=float)
+    parser.add_argument("-n","--star-count",default=50,type=int)
+    parser.add_argument("--seed",default=0,type=int)
+    parser.add_argument("--lat",default=0,type=float)
+    parser.add_argument("--lon",default=0,type=float)
+    parser.add_argument("-j","--jobs",default=os.cpu_count(),type=int)
+    parser.add_argument("-o","--output-dir",default="output/farm")
+
+    args = parser.parse_args()
+
+    constellations = args.constellations or sorted(os.path.splitext(name)[0] for name in os.listdir("resources/constellations") if name.endswith(".svg"))
+    palettes = args.palettes or sorted(name for name in os.listdir("palettes") if name.endswith((".yml",".yaml",".toml")))
+
+    settings = {
+        "width"         : args.width,
+        "height"        : args.height,
+        "scale"         : args.scale,
+        "star_count"    : args.star_count,
+        "star_alpha"    : 0.5,
+        "seed"          : args.seed,
+        "lat"           : args.lat,
+        "lon"           : args.lon,
+        "palette_dir"   : "palettes",
+        "schedule"      : s.ColourSchedule(args.lat,args.lon).schedule
+    }
+
+    jobs = job_matrix(constellations,palettes,args.hours,args.output_dir)
+    manifest = run(jobs,settings,workers=args.jobs,manifest_path=os.path.join(args.output_dir,"manifest.json"))
+
+    print(f"Rendered {manifest['rendered']} and skipped {manifest['skipped']} in {manifest['wall_seconds']:.2f}s")
@@ -0,0 +1,180 @@
+import profiler
+import os
+import json
+import time
+import argparse
+import threading
+
+
+IP_URL = "https://api64.ipify.org/?format=json"
+LOCATION_URL = "http://ip-api.com/json/{ip}"
+
+CACHE_PATH = "output/location.json"
+
+
+@profiler.stage
+def lookup(ip_url: str = IP_URL, location_url: str = LOCATION_URL, timeout: float = 5) -> dict:
+    """
+    Look up the public IP address, and the location it belongs to
+
+    Args:
+        ip_url (str): Service returning {"ip" : ...}
+        location_url (str): Service returning {"lat" : ..., "lon" : ...} for the IP, formatted in as {ip}
+        timeout (float): Timeout of each request in seconds
+
+    Returns:
+        dict: Location, with at least lat and lon
+
+    Raises:
+        requests.RequestException: If either service can't be reached in time or fails (an OSError)
+        ValueError: If a response isn't JSON
+    """
+    import requests
+
+    res = requests.get(ip_url,timeout=timeout)
+    res.raise_for_status()
+    ip = res.json()["ip"]
+    print(f"Public IP address is : {ip}")
+
+    res = requests.get(location_url.format(ip=ip),timeout=timeout)
+    res.raise_for_status()
+    loc = res.json()
+    print("IP based location is {},{},{}\nLat : {}\tLon : {}".format(
+        loc.get("city"),
+        loc.get("regionName"),
+        loc.get("country"),
+        loc["lat"],
+        loc["lon"]
+    ))
+
+    return loc
+
+
+class Locator:
+
+    def __init__(self,
+                 cache_path: str = CACHE_PATH,
+                 ttl: float = 24 * 3600,
+                 ip_url: str = IP_URL,
+                 location_url: str = LOCATION_URL,
+                 timeout: float = 5,
+                 retry_interval: float = 60,
+                 default: tuple = (0,0)) -> None:
+        """
+        IP based location that never holds up rendering. The last known location is
+        kept on disk, used straight away on start-up and refreshed in the background once it is older than the TTL.
+        Without a cached location, the lookup is retried in the background until it succeeds.
+
+        Args:
+            cache_path (str): Location cache
+            ttl (float): Seconds a cached location is considered fresh
+            ip_url (str): See lookup
+            location_url (str): See lookup
+            timeout (float): Timeout of each request in seconds
+            retry_interval (float): Seconds between attempts while there's no location at all
+            default (tuple): Location to fall back to while nothing is known
+        """
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.ip_url = ip_url
+        self.location_url = location_url
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.default = default
+
+        self.cached = self.load()
+        self.attempted = threading.Event()
+        self.thread = None
+
+    def load(self) -> dict:
+        """
+        The cached location, or None if there is none or it isn't a usable location, so it is looked up again
+        """
+        if not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path) as file:
+                cached = json.load(file)
+        except (OSError,ValueError):
+            return None
+
+        def is_number(value):
+            return isinstance(value,(int,float)) and not isinstance(value,bool)
+
+        if not isinstance(cached,dict) or not (is_number(cached.get("lat")) and is_number(cached.get("lon"))):
+            print(f"Ignoring malformed location cache : {self.cache_path}")
+            return None
+        return cached
+
+    def store(self, location: dict) -> None:
+        os.makedirs(os.path.dirname(self.cache_path) or ".",exist_ok=True)
+        temporary = f"{self.cache_path}.tmp"
+        with open(temporary,"w") as file:
+            json.dump(location,file,indent=4)
+        os.replace(temporary,self.cache_path)
+
+    def is_fresh(self) -> bool:
+        # Caches written without a lookup time count as expired
+        looked_up = self.cached.get("time") if self.cached is not None else None
+        return looked_up is not None and time.time() - looked_up < self.ttl
+
+    def refresh(self) -> None:
+        while True:
+            try:
+                loc = lookup(self.ip_url,self.location_url,self.timeout)
+                self.cached = {"lat" : loc["lat"], "lon" : loc["lon"], "city" : loc.get("city"), "time" : time.time()}
+                self.store(self.cached)
+                self.attempted.set()
+                return
+            except (OSError,ValueError,KeyError) as e:
+                print(f"Location lookup failed : {e}")
+                self.attempted.set()
+                # Keep trying only while there's nothing to fall back on
+                if self.cached is not None:
+                    return
+                time.sleep(self.retry_interval)
+
+    def start(self) -> None:
+        """
+        Look the location up in the background, unless the cached one is still fresh
+        """
+        if self.is_fresh():
+            self.attempted.set()
+            return
+        if self.thread is None or not self.thread.is_alive():
+            self.attempted.clear()
+            self.thread = threading.Thread(target=self.refresh,daemon=True)
+            self.thread.start()
+
+    def location(self, wait: float = None) -> tuple:
+        """
+        Best known location
+
+        Args:
+            wait (float): Seconds to wait for a lookup in progress when nothing is cached,
+            defaults to the time both requests may take
+
+        Returns:
+            tuple: lat, lon
+        """
+        if self.cached is None:
+            self.start()
+            self.attempted.wait(2 * self.timeout if wait is None else wait)
+        if self.cached is None:
+            return self.default
+        return self.cached["lat"],self.cached["lon"]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Look up and cache the IP based location, e.g. against a local stub server")
+    parser.add_argument("--cache",default=CACHE_PATH)
+    parser.add_argument("--ttl",default=24,type=float,help="Hours a cached location stays fresh")
+    parser.add_argument("--ip-url",default=IP_URL)
+    parser.add_argument("--location-url",default=LOCATION_URL)
+    parser.add_argument("--timeout",default=5,type=float)
+    args = parser.parse_args()
+
+    locator = Locator(args.cache,args.ttl * 3600,args.ip_url,args.location_url,args.timeout)
+    locator.start()
+    print(locator.location())
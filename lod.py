@@ -0,0 +1,240 @@
+import assets
+import profiler
+import svgmanip as svg
+import time
+import argparse
+import numpy as np
+from copy import deepcopy
+
+
+def point_line_distance(points: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """
+    Distance of every point in an Nx2 array from the line segment start -> end
+    """
+    direction = end - start
+    length = direction @ direction
+    if length == 0:
+        return np.hypot(*(points - start).T)
+    t = np.clip((points - start) @ direction / length,0,1)
+    return np.hypot(*(points - (start + t[:,None] * direction)).T)
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Drop points of a polyline that are within the tolerance of the simplified line, keeping both ends
+
+    Returns:
+        np.ndarray: Boolean mask of the points kept
+    """
+    keep = np.zeros(len(points),dtype=bool)
+    keep[[0,-1]] = True
+    stack = [(0,len(points) - 1)]
+    while stack:
+        first,last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = point_line_distance(points[first + 1:last],points[first],points[last])
+        furthest = int(distances.argmax())
+        if distances[furthest] > tolerance:
+            middle = first + 1 + furthest
+            keep[middle] = True
+            stack.extend([(first,middle),(middle,last)])
+    return keep
+
+
+def format_number(value: float, decimals: int) -> str:
+    text = f"{value:.{decimals}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text in ("-0","") else text
+
+
+def simplify_path(d: str, tolerance: float, quantum: float) -> tuple:
+    """
+    Simplify path data within a tolerance, in the path's own units.
+
+    Cubic and quadratic curves that are flat to within the tolerance become lines,
+    runs of lines are thinned with Douglas-Peucker, and every coordinate is rounded to the quantum.
+
+    Args:
+        d (str): Path data
+        tolerance (float): Largest distance the outline may move by, before rounding
+        quantum (float): Grid coordinates are rounded to
+
+    Returns:
+        tuple: Simplified path data, and the number of segments before and after
+    """
+    decimals = max(0,int(np.ceil(-np.log10(quantum)))) if quantum > 0 else 6
+
+    def point(p):
+        return f"{format_number(p[0],decimals)},{format_number(p[1],decimals)}"
+
+    segments = assets.parse_path(d)
+    output = []
+    count = 0
+    run = []
+    current = np.zeros(2)
+    control = None
+    previous = None
+
+    def flush():
+        nonlocal count
+        if len(run) > 1:
+            points = np.array(run)
+            kept = points[douglas_peucker(points,tolerance)][1:]
+            output.append("L " + " ".join(point(p) for p in kept))
+            count += len(kept)
+        run.clear()
+
+    for command,values in segments:
+        # S only continues a cubic (C or S) smoothly, and T a quadratic (Q or T); after anything else they start from the current point
+        smooth = (command == "S" and previous in ("C","S")) or (command == "T" and previous in ("Q","T"))
+        previous_control,control = control if smooth else None,None
+        previous = command
+
+        match command:
+            case "M":
+                flush()
+                current = np.array(values[0])
+                output.append(f"M {point(current)}")
+                count += 1
+                run.append(current)
+                continue
+            case "Z":
+                flush()
+                output.append("Z")
+                count += 1
+                current = np.array(values[0])
+                run.append(current)
+                continue
+            case "A":
+                flush()
+                output.append("A " + " ".join(format_number(value,decimals) for value in values[:5]) + f" {point(values[5])}")
+                count += 1
+                current = np.array(values[5])
+                run.append(current)
+                continue
+            case "S":
+                # The first control point mirrors the previous curve's second
+                reflected = 2*current - previous_control if previous_control is not None else current
+                values = [tuple(reflected)] + values
+                command = "C"
+            case "T":
+                reflected = 2*current - previous_control if previous_control is not None else current
+                values = [tuple(reflected)] + values
+                command = "Q"
+
+        points = np.array(values,dtype=float)
+        end = points[-1]
+        if command in ("C","Q"):
+            control = points[-2]
+            if point_line_distance(points[:-1],current,end).max() > tolerance:
+                flush()
+                output.append(f"{command} " + " ".join(point(p) for p in points))
+                count += 1
+                current = end
+                run.append(current)
+                continue
+
+        # Lines, and curves flat enough to be drawn as lines
+        if not run:
+            run.append(current)
+        run.append(end)
+        current = end
+
+    flush()
+
+    return " ".join(output),len(segments),count
+
+
+def simplify_tree(root, scale: float, tolerance: float, matrix: np.ndarray = None) -> tuple:
+    """
+    Simplify every path under an element in place, for an element drawn at a scale factor
+
+    Args:
+        root: lxml element
+        scale (float): Pixels per user unit the element is drawn at
+        tolerance (float): Largest visual error in pixels
+        matrix (np.ndarray): Transform of the element's parent
+
+    Returns:
+        tuple: Number of path segments before and after
+    """
+    if matrix is None:
+        matrix = np.eye(3)
+    matrix = matrix @ assets.parse_transform(root.get("transform"))
+
+    before,after = 0,0
+    if root.tag == f"{assets.SVG_NAMESPACE}path" and root.get("d"):
+        # Pixels per path unit, along the direction stretched most
+        pixels = scale * np.linalg.norm(matrix[:2,:2],2)
+        # Half the tolerance goes to simplifying, half to rounding (which moves points by at most half the quantum's diagonal)
+        d,before,after = simplify_path(root.get("d"),tolerance / 2 / pixels,tolerance / np.sqrt(2) / pixels)
+        root.set("d",d)
+
+    for child in root.iterchildren(f"{assets.SVG_NAMESPACE}*"):
+        child_before,child_after = simplify_tree(child,scale,tolerance,matrix)
+        before += child_before
+        after += child_after
+
+    return before,after
+
+
+@profiler.stage
+def simplify(obj: svg.Element, factor: float, tolerance: float) -> svg.Element:
+    """
+    Level of detail: a copy of an object with its paths simplified for being drawn at a scale factor,
+    so the outline moves by at most the tolerance in pixels
+
+    Args:
+        obj (svg.Element): Unscaled object
+        factor (float): Scale factor it will be drawn at, see Canvas.get_scale_factor
+        tolerance (float): Largest visual error in pixels
+
+    Returns:
+        svg.Element: Simplified copy
+    """
+    obj = deepcopy(obj)
+    simplify_tree(obj.root,factor,tolerance)
+    return obj
+
+
+if __name__ == "__main__":
+
+    import artist as a
+    import main
+
+    parser = argparse.ArgumentParser(description="Report what path simplification saves for a constellation")
+    parser.add_argument("constellation")
+    parser.add_argument("--width",default=3440,type=int)
+    parser.add_argument("--height",default=1440,type=int)
+    parser.add_argument("-s","--scale",default=0.7,type=float)
+    parser.add_argument("-n","--star-count",default=50,type=int)
+    parser.add_argument("--star-mode",default="instance",choices=["instance","copy"])
+    parser.add_argument("-t","--tolerances",nargs="*",default=[0,0.1,0.25,0.5,1],type=float,help="Tolerances in pixels")
+    parser.add_argument("--repeat",default=3,type=int)
+    args = parser.parse_args()
+
+    # Render times are only comparable between runs on the same rasterizer, so say which one took them
+    rasterizer = a.rasterizer()
+    print(f"Rendering with {rasterizer}")
+    if "unknown" in rasterizer:
+        print("Warning: not a working cairosvg and cairo, so the render times below are not cairo's")
+
+    scene = main.Scene(args.scale,args.star_count,0.5,args.constellation,star_mode=args.star_mode,seed=0)
+
+    for tolerance in args.tolerances:
+        scene.tolerance = tolerance
+        canvas = scene.draw(args.width,args.height)
+        svg_string = canvas.dumps()
+        constellation = a.Canvas(args.width,args.height).get_scale_factor(scene.constellation,args.scale)
+        before,after = simplify_tree(deepcopy(scene.constellation.root),constellation,tolerance) if tolerance > 0 else (0,0)
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            a.rasterize(svg_string,None,args.width,args.height)
+            timings.append(time.perf_counter() - start)
+
+        segments = f"constellation segments {before} -> {after}" if tolerance > 0 else "unsimplified"
+        print(f"tolerance {tolerance:<5} px : SVG {len(svg_string):>8} bytes, render {min(timings) * 1000:8.1f} ms, {segments}")
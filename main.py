@@ -1,70 +1,690 @@
 import artist as a
+import assets
+import cache as ch
 import painter as p
+import placement as pl
+import location as l
+import lod
+import profiler
 import schedule as s
 import random
-from copy import deepcopy
 from datetime import datetime, timedelta
 import time
 import os
 import subprocess
+import shutil
 import argparse
-import requests
-import svgmanip as svg
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor,as_completed
+from contextlib import nullcontext
 
+# compositor, tiler, animator and stamper are slow to import and most runs never need them,
+# so they are imported where they are used
 
 
+
+class Scene:
+
+    star_sizes = [0.005,0.025]
+
+    @profiler.stage
+    def __init__(self,
+                 scale_factor : float,
+                 star_count : int,
+                 star_alpha : float,
+                 constellation: str,
+                 star_mode: str = "instance",
+                 seed: int = None,
+                 min_distance: float = 0,
+                 keep_out: float = None,
+                 reference: tuple = (3440,1440),
+                 tolerance: float = 0) -> None:
+        """
+        Resolution independent drawing: the parsed constellation and star, and a star layout
+        in normalized (0->1) canvas coordinates, so the same scene can be drawn at any size.
+
+        Args:
+            scale_factor (float): Constellation size, as a fraction of the canvas
+            star_count (int): Number of stars
+            star_alpha (float): Star alpha
+            constellation (str): Name of the constellation in resources/constellations
+            star_mode (str): "instance" or "copy", see Canvas.place_instances
+            seed (int): Seed for the star layout
+            min_distance (float): Minimum distance between stars, in pixels of the reference size
+            keep_out (float): Margin around the constellation stars are kept out of, in pixels of the reference size
+            reference (tuple): Canvas size the star layout is worked out at
+            tolerance (float): Visual error in pixels paths may be simplified by for their size on the canvas, 0 to draw them as they are
+        """
+        self.scale_factor = scale_factor
+        self.star_alpha = star_alpha
+        self.star_mode = star_mode
+        self.keep_out = keep_out
+        self.reference = reference
+        self.tolerance = tolerance
+
+        self.constellation = assets.load(f"resources/constellations/{constellation}.svg").element()
+        self.star_asset = assets.load("resources/star.svg")
+        self.star = self.star_asset.element()
+
+        width,height = reference
+        field = pl.StarField(width,height,sizes=self.star_sizes,seed=seed)
+        xs,ys,self.scales = field.place(star_count,min_distance=min_distance,keep_out=self.keep_out_box(width,height))
+        if len(xs) < star_count:
+            print(f"Warning : only placed {len(xs)} of {star_count} stars, try a smaller keep-out or minimum distance")
+
+        self.xs = xs / width
+        self.ys = ys / height
+
+        # Seeded last, so the canvases drawn from the scene are reproducible
+        if seed is not None:
+            random.seed(seed)
+
+    def keep_out_box(self, width: int, height: int) -> tuple:
+        """
+        Constellation bounding box at a canvas size, grown by the keep-out margin (scaled from the reference size)
+        """
+        if self.keep_out is None:
+            return None
+
+        canvas = a.Canvas(width,height)
+        factor = canvas.get_scale_factor(self.constellation,self.scale_factor)
+        x,y = canvas.get_centre_coordinates(self.constellation,factor)
+        margin = self.keep_out * min(width / self.reference[0],height / self.reference[1])
+
+        return (x - margin,
+                y - margin,
+                x + self.constellation.width*factor + margin,
+                y + self.constellation.height*factor + margin)
+
+    def star_layout(self, canvas: a.Canvas) -> tuple:
+        """
+        Stars on a canvas of the scene's size
+
+        Returns:
+            tuple: Arrays of the stars' top-left corners (xs, ys), scales (as a fraction of the canvas) and scale factors
+        """
+        xs = self.xs * canvas.width
+        ys = self.ys * canvas.height
+        scales = self.scales
+
+        # The constellation box moves with the aspect ratio, so keep stars clear of it at this size too
+        keep_out_box = self.keep_out_box(canvas.width,canvas.height)
+        if keep_out_box is not None:
+            x0,y0,x1,y1 = keep_out_box
+            outside = (xs < x0) | (xs > x1) | (ys < y0) | (ys > y1)
+            xs,ys,scales = xs[outside],ys[outside],scales[outside]
+
+        # Star scale factors are linear in the star scale; offset centres to top-left corners
+        factors = scales * canvas.get_scale_factor(self.star,1)
+        xs = xs - factors * self.star.width / 2
+        ys = ys - factors * self.star.height / 2
+
+        return xs,ys,scales,factors
+
+    @profiler.stage
+    def draw(self, canvas_width: int, canvas_height: int, stars: bool = True) -> a.Canvas:
+        """
+        Draw the scene on a canvas of a given size, leaving the stars out if they are rasterized separately
+        (see stamper.StarStamper)
+        """
+        canvas = a.Canvas(canvas_width,canvas_height)
+        constellation_scaled,factor = canvas.scale_object(self.constellation,scale=self.scale_factor,tolerance=self.tolerance)
+
+        x,y = canvas.get_centre_coordinates(constellation_scaled,factor)
+        canvas.place_object(constellation_scaled,x,y,layer="foreground")
+
+        if not stars:
+            return canvas
+
+        star = self.star
+        xs,ys,scales,factors = self.star_layout(canvas)
+
+        match self.star_mode:
+            case "copy":
+                for x,y,scale in zip(xs,ys,scales):
+                    star_scaled,factor = canvas.scale_object(star,scale,tolerance=self.tolerance)
+                    star_scaled = canvas.set_object_alpha(star_scaled,fill_alpha=self.star_alpha,stroke_alpha=0)
+                    canvas.place_object(star_scaled,x,y,layer="detail")
+            case "instance":
+                if self.tolerance > 0 and len(factors):
+                    # Every instance shares the symbol, so simplify it for the biggest star
+                    star = lod.simplify(star,factors.max(),self.tolerance)
+                instances = [(x,y,factor,self.star_alpha) for x,y,factor in zip(xs.tolist(),ys.tolist(),factors.tolist())]
+                canvas.place_instances(star,instances,layer="detail")
+
+        return canvas
+
+
+@profiler.stage
 def draw(canvas_width : int,
          canvas_height : int,
          scale_factor : float,
          star_count : int,
          star_alpha : float, 
-         constellation: str) -> a.Canvas:
+         constellation: str,
+         star_mode: str = "instance",
+         seed: int = None,
+         min_distance: float = 0,
+         keep_out: float = None,
+         tolerance: float = 0) -> a.Canvas:
+
+    scene = Scene(scale_factor,
+                  star_count,
+                  star_alpha,
+                  constellation,
+                  star_mode=star_mode,
+                  seed=seed,
+                  min_distance=min_distance,
+                  keep_out=keep_out,
+                  reference=(canvas_width,canvas_height),
+                  tolerance=tolerance)
+
+    return scene.draw(canvas_width,canvas_height)
+
+_worker_template = None
+
+def _init_worker(template: a.SVGTemplate) -> None:
+    global _worker_template
+    _worker_template = template
+
+
+@profiler.stage
+def render_hour(hour: int,
+                transform: dict,
+                target_alpha: float,
+                path: str,
+                width: int,
+                height: int) -> tuple:
+    """
+    Fill in and rasterize one hour of the schedule from the worker's copy of the canvas template
+    """
+    target = _worker_template.render(transform,target_alpha)
+    a.rasterize(target,path,width,height)
+    return hour,path
+
+
+def cache_variant(render: str, glow: float = 0, glow_strength: float = 1, detail: "c.LayerMasks" = None) -> tuple:
+    """
+    What sets a render apart beyond the canvas template and colours, for cache keys. Glow and stamped stars
+    (which aren't in the template) are only drawn by the compositor, so they imply the composite renderer.
+
+    Returns:
+        tuple: Renderer to use, and its cache key part
+    """
+    if glow == 0 and detail is None:
+        return render,render
+    stars = None if detail is None else ch.digest(detail.coverage.tobytes())
+    return "composite",["composite",glow,glow_strength,stars]
+
+
+@profiler.stage
+def export_static(canvas: a.Canvas,
+                  schedule: s.ColourSchedule,
+                  palette_file: str,
+                  star_alpha: float,
+                  jobs: int = 1,
+                  output_dir: str = "output/static",
+                  render: str = "svg",
+                  cache: ch.RenderCache = None,
+                  tile_height: int = 0,
+                  palettes: p.PaletteTable = None,
+                  glow: float = 0,
+                  glow_strength: float = 1,
+                  detail: "c.LayerMasks" = None) -> dict:
+    """
+    Export one PNG per scheduled hour, optionally across a pool of worker processes.
+    Workers only receive the compiled canvas template (once, on start-up) and a colour map per hour.
+    With the composite renderer, the canvas is rasterized once and every hour is composited in-process instead.
+    With a tile height, hours are rendered one at a time, each in bands across the worker processes and streamed to disk.
+    Glow and stamped stars are only drawn by the compositor, so they imply the composite renderer.
+
+    Args:
+        canvas (a.Canvas): Drawn canvas
+        schedule (s.ColourSchedule): Colour schedule to export
+        palette_file (str): Path to the palette
+        star_alpha (float): Star alpha the canvas was drawn with
+        jobs (int): Number of worker processes
+        output_dir (str): Directory to write PNGs and the manifest to
+        render (str): "svg" to rasterize every hour, "composite" to recolour cached layer masks
+        cache (ch.RenderCache): Render cache to copy hits from and store fresh renders in
+        tile_height (int): Band height for tiled rendering, 0 to rasterize every hour in one piece
+        palettes (p.PaletteTable): Precomputed colour maps for the schedule, built from palette_file if None
+        glow (float): Standard deviation of the glow around stars and lines in pixels, 0 for none
+        glow_strength (float): Brightness of the glow
+        detail (c.LayerMasks): Stars stamped by stamper.StarStamper, for a canvas drawn without them
+
+    Returns:
+        dict: The manifest, which is also written to <output_dir>/manifest.json
+    """
+    os.makedirs(output_dir,exist_ok=True)
+
+    render,variant = cache_variant(render,glow,glow_strength,detail)
+
+    if palettes is None:
+        palettes = p.PaletteTable(palette_file,schedule.schedule)
+
+    tasks = []
+    for hour,colours in schedule.schedule.items():
+        print(f"Hour : {hour}\t\t{colours}" )
+        transform = palettes.create_transform(hour)
+        tasks.append((hour,
+                      transform,
+                      colours["star_al"],
+                      f"{output_dir}/constellation_{hour}.png",
+                      canvas.width,
+                      canvas.height))
+
+    template = canvas.compile(star_alpha)
+
+    # Hours that resolve to the same colours are rendered (or copied from the cache) once
+    scene = ch.digest(template.source.encode())
+    palette_digest = ch.file_digest(palette_file)
+    keys = {}
+    outputs = {}
+    pending = []
+    duplicates = []
+    for task in tasks:
+        hour,transform,target_alpha,path,width,height = task
+        keys[hour] = ch.RenderCache.key(scene,palette_digest,transform,target_alpha,width,height,variant)
+        if keys[hour] in outputs:
+            duplicates.append((keys[hour],path))
+            continue
+        outputs[keys[hour]] = path
+        cached = cache.get(keys[hour]) if cache is not None else None
+        if cached is not None:
+            shutil.copyfile(cached,path)
+        else:
+            pending.append(task)
+
+    if pending:
+        if render == "composite":
+            import compositor as c
+            compositor = c.Compositor(canvas,star_alpha,glow=glow,glow_strength=glow_strength,detail=detail)
+            for hour,transform,target_alpha,path,_,_ in pending:
+                compositor.export(transform,target_alpha,path)
+        elif tile_height > 0:
+            import tiler as t
+            # One pool renders the bands of every hour, each band task carrying its hour's SVG
+            with ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext() as pool:
+                for hour,transform,target_alpha,path,width,height in pending:
+                    t.export_tiled(template.render(transform,target_alpha),path,width,height,tile_height,jobs,pool)
+                    print(f"Rendered hour {hour} to {path}")
+        elif jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs,
+                                     initializer=_init_worker,
+                                     initargs=(template,)) as pool:
+                futures = [pool.submit(render_hour,*task) for task in pending]
+                for future in as_completed(futures):
+                    hour,path = future.result()
+                    print(f"Rendered hour {hour} to {path}")
+        else:
+            _init_worker(template)
+            for task in pending:
+                render_hour(*task)
+
+    if cache is not None:
+        for hour,_,_,path,_,_ in pending:
+            cache.store(keys[hour],path)
+        print(f"Render cache : {cache}")
+
+    # Copied from the first hour's own output, as a small cache may already have evicted its entry
+    for key,path in duplicates:
+        shutil.copyfile(outputs[key],path)
+
+    manifest = {
+        "palette"   : os.path.basename(palette_file),
+        "width"     : canvas.width,
+        "height"    : canvas.height,
+        "hours"     : [
+            {
+                "hour"      : hour,
+                "path"      : os.path.basename(path),
+                "star_al"   : target_alpha,
+                "colours"   : transform
+            }
+            for hour,transform,target_alpha,path,_,_ in sorted(tasks,key=lambda task: task[0])
+        ]
+    }
+
+    with open(f"{output_dir}/manifest.json","w") as file:
+        json.dump(manifest,file,indent=4,sort_keys=True)
+
+    return manifest
+
+
+@profiler.stage
+def export_resolutions(scene: Scene,
+                       resolutions: list,
+                       schedule: s.ColourSchedule,
+                       palette_file: str,
+                       output_dir: str = "output/static",
+                       star_renderer: str = "svg",
+                       **kwargs) -> dict:
+    """
+    Export every scheduled hour at several sizes from one scene. The assets, star layout,
+    palette and hourly colour maps are worked out once and shared by every size.
+
+    Args:
+        scene (Scene): Scene to draw
+        resolutions (list): (width, height) pairs
+        schedule (s.ColourSchedule): Colour schedule to export
+        palette_file (str): Path to the palette
+        output_dir (str): Each size is written to <output_dir>/<width>x<height>
+        star_renderer (str): "svg" to draw the stars into the canvas, "raster" to stamp them (see stamper.StarStamper)
+        kwargs: Passed on to export_static
+
+    Returns:
+        dict: {"<width>x<height>" : manifest}
+    """
+    palettes = p.PaletteTable(palette_file,schedule.schedule)
+
+    stamper = None
+    if star_renderer == "raster":
+        import stamper as st
+        stamper = st.StarStamper(scene)
+
+    manifests = {}
+    for width,height in resolutions:
+        name = f"{width}x{height}"
+        print(f"Resolution : {name}")
+        canvas = scene.draw(width,height,stars=stamper is None)
+        manifests[name] = export_static(canvas,
+                                        schedule,
+                                        palette_file,
+                                        scene.star_alpha,
+                                        output_dir=f"{output_dir}/{name}",
+                                        palettes=palettes,
+                                        detail=None if stamper is None else stamper.stamp(canvas),
+                                        **kwargs)
+    return manifests
+
+
+@profiler.stage
+def export_animated(scene: Scene,
+                    canvas: a.Canvas,
+                    schedule: s.ColourSchedule,
+                    palette_file: str,
+                    output_dir: str = "output/animated",
+                    frames: int = 60,
+                    fps: float = 15,
+                    format: str = "apng",
+                    depth: float = 0.5,
+                    seed: int = None) -> None:
+    """
+    Export a looping animation of twinkling stars per scheduled hour. The canvas is rasterized
+    once, and hours with the same colours share one animation.
+
+    Args:
+        scene (Scene): Scene the canvas was drawn from
+        canvas (a.Canvas): Drawn canvas
+        schedule (s.ColourSchedule): Colour schedule to export
+        palette_file (str): Path to the palette
+        output_dir (str): Directory to write animations to
+        frames (int): Frames per animation
+        fps (float): Frames per second
+        format (str): "apng" for constellation_<hour>.png, "frames" for a constellation_<hour> directory of frames
+        depth (float): How far stars dim, as a fraction of their opacity
+        seed (int): Seed for the twinkling
+    """
+    import animator as an
+
+    os.makedirs(output_dir,exist_ok=True)
+    palettes = p.PaletteTable(palette_file,schedule.schedule)
+    animation = an.Animator(scene,canvas,depth=depth,seed=seed)
+
+    rendered = {}
+    for hour,colours in schedule.schedule.items():
+        transform = palettes.create_transform(hour)
+        path = f"{output_dir}/constellation_{hour}" + (".png" if format == "apng" else "")
+        key = ch.RenderCache.key(transform,colours["star_al"])
+
+        if key in rendered:
+            if format == "apng":
+                shutil.copyfile(rendered[key],path)
+            else:
+                shutil.copytree(rendered[key],path,dirs_exist_ok=True)
+        else:
+            animation.export(transform,colours["star_al"],path,frames=frames,fps=fps,format=format)
+            rendered[key] = path
+        print(f"Animated hour {hour} to {path}")
+
+
+def parse_resolutions(value: str) -> list:
+    """
+    Parse "1920x1080,3840x2160" into [(1920, 1080), (3840, 2160)]
+
+    Raises:
+        argparse.ArgumentTypeError: Unless every resolution is exactly <width>x<height>, in positive whole pixels
+    """
+    resolutions = []
+    for resolution in value.split(","):
+        match = re.fullmatch(r"\s*(\d+)\s*[xX]\s*(\d+)\s*",resolution)
+        if match is None or int(match[1]) == 0 or int(match[2]) == 0:
+            raise argparse.ArgumentTypeError(f"Expected <width>x<height>[,<width>x<height>...] in positive whole pixels, got {resolution!r}")
+        resolutions.append((int(match[1]),int(match[2])))
+    return resolutions
+
+
+class Daemon:
+
+    def __init__(self,
+                 canvas: a.Canvas,
+                 star_alpha: float,
+                 palette_file: str,
+                 lat: float,
+                 lon: float,
+                 render: str = "svg",
+                 cache: ch.RenderCache = None,
+                 output_dir: str = "output",
+                 profile_dir: str = None,
+                 tile_height: int = 0,
+                 jobs: int = 1,
+                 locator: l.Locator = None,
+                 interval: int = 60,
+                 glow: float = 0,
+                 glow_strength: float = 1,
+                 detail: "c.LayerMasks" = None) -> None:
+        """
+        Keeps the desktop wallpaper in step with the colour schedule.
+        The next hour's wallpaper is rendered by a background worker while the current one is shown,
+        written to a fresh file and switched to at the hour boundary.
+
+        Args:
+            canvas (a.Canvas): Drawn canvas
+            star_alpha (float): Star alpha the canvas was drawn with
+            palette_file (str): Path to the palette
+            lat (float): Latitude for the colour schedule
+            lon (float): Longitude for the colour schedule
+            render (str): "svg" or "composite", see export_static
+            cache (ch.RenderCache): Render cache, if any
+            output_dir (str): Directory to write wallpapers to
+            profile_dir (str): Directory to write a profile per render and a cumulative summary to, if profiling
+            tile_height (int): Band height for tiled rendering, 0 to rasterize in one piece
+            jobs (int): Number of worker processes rendering bands
+            locator (l.Locator): Source of location updates, if the location is looked up
+            interval (int): Minutes between wallpapers, a divisor of 60. Below 60, colours are
+            interpolated between hours and every wallpaper is composited from cached layers.
+            glow (float): Standard deviation of the glow in pixels, 0 for none. Glow is composited too.
+            glow_strength (float): Brightness of the glow
+            detail (c.LayerMasks): Stars stamped by stamper.StarStamper, for a canvas drawn without them
+        """
+        self.canvas = canvas
+        self.star_alpha = star_alpha
+        self.palette_file = palette_file
+        self.lat = lat
+        self.lon = lon
+        # Blended colours only ever come from the compositor
+        self.render_mode,self.variant = cache_variant(render if interval == 60 else "composite",glow,glow_strength,detail)
+        self.cache = cache
+        self.output_dir = output_dir
+        self.profile_dir = profile_dir
+        self.tile_height = tile_height
+        self.jobs = jobs
+        self.locator = locator
+        self.interval = interval
+
+        self.compositor = None
+        if self.render_mode == "composite":
+            import compositor as c
+            self.compositor = c.Compositor(canvas,star_alpha,glow=glow,glow_strength=glow_strength,detail=detail)
+        self.template = canvas.compile(star_alpha)
+        self.scene = ch.digest(self.template.source.encode())
+        self.palette_digest = ch.file_digest(palette_file)
+        self.table = s.ScheduleTable.cached(lat,lon,datetime.now().year)
+        self.palette_tables = {}
+        self.schedule_day(datetime.now())
+
+        self.wallpaper = None
+        self.wallpaper_digest = None
+        self.worker = ThreadPoolExecutor(max_workers=1)
+
+        os.makedirs(output_dir,exist_ok=True)
+
+    def schedule_day(self, when: datetime) -> None:
+        """
+        Point the schedule and colour maps at the day of a given time, looked up in the yearly schedule table
+        """
+        if self.table.year != when.year or (self.table.lat,self.table.long) != (self.lat,self.lon):
+            self.table = s.ScheduleTable.cached(self.lat,self.lon,when.year)
+            self.palette_tables = {}
+
+        # Days with the same sunrise and sunset hours share their colour maps
+        day = self.table.day(when)
+        if day not in self.palette_tables:
+            self.palette_tables[day] = p.PaletteTable(self.palette_file,self.table.schedule(when))
+
+        self.schedule = self.table.schedule(when)
+        self.palettes = self.palette_tables[day]
+
+    def is_cached(self, path: str) -> bool:
+        return self.cache is not None and os.path.dirname(path) == self.cache.directory
+
+    @profiler.stage
+    def render(self, when: datetime) -> str:
+        """
+        Render the wallpaper for a given time: its hour, or the exact minute if the interval is shorter
+
+        Returns:
+            str: Path to the wallpaper, either in the render cache or a fresh file in the output directory
+        """
+        # Pick up a new location if the lookup came back with one
+        if self.locator is not None:
+            self.locator.start()
+            location = self.locator.location(wait=0)
+            if location != (self.lat,self.lon):
+                print(f"Location changed to {location}")
+                self.lat,self.lon = location
+
+        self.schedule_day(when)
+
+        if self.interval < 60:
+            colours = self.table.interpolated(when)
+            target_alpha = colours["star_al"]
+            print(f"{when:%H:%M}\t\t{colours}" )
+            colours = self.palettes.transform_for(colours)
+        else:
+            colours = self.schedule[when.hour]
+            target_alpha = colours["star_al"]
+            print(f"Hour : {when.hour}\t\t{colours}" )
+            colours = self.palettes.create_transform(when.hour)
+
+        if self.cache is not None:
+            key = self.cache.key(self.scene,self.palette_digest,colours,target_alpha,self.canvas.width,self.canvas.height,self.variant)
+            wallpaper = self.cache.get(key)
+            if wallpaper is not None:
+                print(f"Render cache hit, skipping render : {self.cache}")
+                return wallpaper
+
+        # Never write into the file that is currently displayed; render next to it and move into place
+        path = os.path.join(self.output_dir,f"constellation-{self.stamp(when)}.png")
+        temporary = f"{path}.tmp"
+
+        if self.compositor is not None:
+            # Frames only live for a few minutes, so favour encoding speed over size
+            self.compositor.export(colours,target_alpha,temporary,compress_level=6 if self.interval == 60 else 1)
+        elif self.tile_height > 0:
+            import tiler as t
+            target = self.template.render(colours,target_alpha)
+            t.export_tiled(target,temporary,self.canvas.width,self.canvas.height,self.tile_height,self.jobs)
+        else:
+            target = self.template.render(colours,target_alpha)
+            a.rasterize(target,temporary,self.canvas.width,self.canvas.height)
+
+        os.replace(temporary,path)
+
+        if self.cache is not None:
+            wallpaper = self.cache.store(key,path)
+            os.remove(path)
+            print(f"Render cache : {self.cache}")
+            return wallpaper
+
+        return path
+
+    @profiler.stage
+    def switch(self, path: str) -> None:
+        """
+        Point the desktop at a rendered wallpaper, unless it already shows the same image.
+        Wallpapers from the render cache are copied out of it first.
+        """
+        digest = ch.file_digest(path)
+        if path == self.wallpaper or digest == self.wallpaper_digest:
+            print(f"Wallpaper unchanged, keeping {self.wallpaper}")
+            if path != self.wallpaper and not self.is_cached(path):
+                os.remove(path)
+            return
+
+        if self.is_cached(path):
+            # The cache may evict its copy while it is shown, so the desktop gets a copy of its own
+            displayed = os.path.join(self.output_dir,os.path.basename(path))
+            shutil.copyfile(path,f"{displayed}.tmp")
+            os.replace(f"{displayed}.tmp",displayed)
+            path = displayed
+
+        abspath = os.path.abspath(path)
+
+        subprocess.call(["gsettings","set","org.gnome.desktop.background","picture-uri",
+                        f"file://{abspath}"])
+        subprocess.call(["gsettings","set","org.gnome.desktop.background","picture-uri-dark",
+                        f"file://{abspath}"])
+
+        previous = self.wallpaper
+        self.wallpaper = path
+        self.wallpaper_digest = digest
+
+        if previous is not None and os.path.exists(previous):
+            os.remove(previous)
+
+    def stamp(self, when: datetime) -> str:
+        return f"{when:%Y%m%d%H}" if self.interval == 60 else f"{when:%Y%m%d%H%M}"
+
+    def next_update(self, now: datetime) -> datetime:
+        hour = now.replace(microsecond=0, second=0, minute=0)
+        return hour + timedelta(minutes=(now.minute // self.interval + 1) * self.interval)
+
+    def profile(self, when: datetime) -> None:
+        if self.profile_dir is not None:
+            profiler.flush(os.path.join(self.profile_dir,f"render-{self.stamp(when)}.json"),label=f"{when:%Y-%m-%d %H:%M}")
+            profiler.dump_summary(os.path.join(self.profile_dir,"summary.json"))
+
+    def run(self) -> None:
+        now = datetime.now()
+        self.switch(self.render(now))
+        self.profile(now)
 
-    star_sizes = [0.005,0.025]
-
-    canvas = a.Canvas(canvas_width,canvas_height)
-    constellation = svg.Element(f"resources/constellations/{constellation}.svg")
-    star = svg.Element("resources/star.svg")
-    constellation_scaled,factor = canvas.scale_object(constellation,scale=scale_factor)
-
-    x,y = canvas.get_centre_coordinates(constellation_scaled,factor)
-    canvas.place_object(constellation_scaled,x,y,layer="foreground")
-
-    for i in range(star_count):
-        scale = random.uniform(star_sizes[0],star_sizes[1])
-        x = random.uniform(0,canvas_width)
-        y = random.uniform(0,canvas_height)
-        star_scaled,factor = canvas.scale_object(star,scale)
-        star_scaled = canvas.set_object_alpha(star_scaled,fill_alpha=star_alpha,stroke_alpha=0)
-        canvas.place_object(star_scaled,x,y,layer="detail")
-    
-    return canvas
+        while(True):
 
-def geolocate() -> tuple:
-    lat,lon = 0,0
-    res = requests.get("https://api64.ipify.org/?format=json")
-    ip = None
+            now = datetime.now()
+            next = self.next_update(now)
 
-    if res:
-        ip = res.json()["ip"]
-        print(f"Public IP address is : {ip}")
-    
-    if ip:
-        res = requests.get(f"http://ip-api.com/json/{ip}")
-        print(res)
-        if res:
-            loc = res.json()
-            lat,lon = loc["lat"],loc["lon"]
-            print("IP based location is {},{},{}\nLat : {}\tLon : {}".format(
-                loc["city"],
-                loc["regionName"],
-                loc["country"],
-                lat,
-                lon
-            ))
+            upcoming = self.worker.submit(self.render,next)
 
-    return lat,lon
+            delta = (next - datetime.now()).total_seconds()
+            print(f"Sleeping for {delta} seconds until {next}")
+            time.sleep(max(delta,0))
 
+            self.switch(upcoming.result())
+            self.profile(next)
 
 
 if __name__ == "__main__":
@@ -75,29 +695,84 @@ if __name__ == "__main__":
     parser.add_argument("constellation")
     parser.add_argument("--width",default=3440,type=int)
     parser.add_argument("--height",default=1440,type=int)
-    parser.add_argument("-s","--scale",default=0.7)
-    parser.add_argument("-n","--star-count",default=50)
+    parser.add_argument("--resolutions",default=None,type=parse_resolutions,
+                        help="Export every hour at each of these sizes, e.g. 1920x1080,3440x1440")
+    parser.add_argument("-s","--scale",default=0.7,type=float)
+    parser.add_argument("-n","--star-count",default=50,type=int)
+    parser.add_argument("--star-mode",default="instance",choices=["instance","copy"])
+    parser.add_argument("--star-renderer",default="svg",choices=["svg","raster"],
+                        help="raster stamps pre-rasterized stars instead of drawing them into the SVG, for very large star counts; implies -r composite")
+    parser.add_argument("--seed",default=None,type=int)
+    parser.add_argument("--min-distance",default=0,type=float)
+    parser.add_argument("--keep-out",default=None,type=float)
+    parser.add_argument("--tolerance",default=0,type=float,
+                        help="Simplify paths for their size on screen, by at most this many pixels, e.g. 0.25; 0 (the default) draws them exactly")
     parser.add_argument("-d","--daemon",action="store_true")
     parser.add_argument("-p","--palette",default="kanagawa.yml")
     parser.add_argument("-a","--auto-location",action="store_true")
     parser.add_argument("--lat",default=0)
     parser.add_argument("--lon",default=0)
+    parser.add_argument("--interval",default=60,type=int,help="Minutes between daemon updates; below 60, colours are blended between hours")
+    parser.add_argument("--location-ttl",default=24,type=float,help="Hours a cached auto-location is used before it is looked up again")
+    parser.add_argument("-j","--jobs",default=1,type=int)
+    parser.add_argument("-r","--render",default="svg",choices=["svg","composite"])
+    parser.add_argument("--cache-dir",default="output/cache")
+    parser.add_argument("--cache-size",default=256,type=int,help="Render cache size in MB, 0 disables the cache")
+    parser.add_argument("--glow",default=0,type=float,nargs="?",const=float(a.Canvas.bloom[0].get("stdDeviation")),
+                        help="Glow around stars and lines, with this spread in pixels (that of the SVG bloom filter if not given); implies -r composite")
+    parser.add_argument("--glow-strength",default=1,type=float)
+    parser.add_argument("--animate",default=None,choices=["apng","frames"],help="Export twinkling animations instead of still images")
+    parser.add_argument("--frames",default=60,type=int,help="Frames per animation")
+    parser.add_argument("--fps",default=15,type=float)
+    parser.add_argument("--twinkle",default=0.5,type=float,help="How far stars dim while twinkling, as a fraction of their opacity")
+    parser.add_argument("--tile-height",default=0,type=int,help="Render in bands of this many pixels, streamed to disk, to bound memory on large canvases")
+    parser.add_argument("--profile",action="store_true",help="Write per-stage timings to output/profile")
 
     args = parser.parse_args()
 
+    if args.profile:
+        profiler.enable()
+
     star_alpha = 0.5
 
-    canvas =  draw(args.width,
-                   args.height,
-                   scale_factor=args.scale,
-                   star_count=args.star_count,
-                   star_alpha=star_alpha,
-                   constellation=args.constellation)  
+    # Look the location up while the scene is drawn
+    locator = None
+    if args.auto_location:
+        locator = l.Locator(ttl=args.location_ttl * 3600,default=(float(args.lat),float(args.lon)))
+        locator.start()
+
+    if args.resolutions and args.daemon:
+        parser.error("--resolutions only applies to static exports")
+    if args.animate and (args.daemon or args.resolutions):
+        parser.error("--animate only applies to static exports at one size")
+    if args.interval < 1 or 60 % args.interval:
+        parser.error("--interval must divide 60")
+
+    width,height = args.resolutions[0] if args.resolutions else (args.width,args.height)
+
+    scene = Scene(args.scale,
+                  args.star_count,
+                  star_alpha,
+                  args.constellation,
+                  star_mode=args.star_mode,
+                  seed=args.seed,
+                  min_distance=args.min_distance,
+                  keep_out=args.keep_out,
+                  reference=(width,height),
+                  tolerance=args.tolerance)
+
+    detail = None
+    if args.star_renderer == "raster" and not args.resolutions:
+        import stamper as st
+        canvas = scene.draw(width,height,stars=False)
+        detail = st.StarStamper(scene).stamp(canvas)
+    else:
+        canvas = scene.draw(width,height)
 
     canvas.dump(f"output/constellation.svg")
 
-    if args.auto_location:
-        lat,lon = geolocate()
+    if locator is not None:
+        lat,lon = locator.location()
     else:
         lat,lon = float(args.lat),float(args.lon)
 
@@ -105,68 +780,67 @@ if __name__ == "__main__":
 
     print(f"Colour schedule is calculated as : {schedule}")
 
+    # Unseeded scenes differ on every run, so a one-off export could never hit the cache
+    cache = None
+    if args.cache_size > 0 and (args.daemon or args.seed is not None):
+        cache = ch.RenderCache(args.cache_dir,max_bytes=args.cache_size * 1024**2)
+
     
 
     if not args.daemon:
 
-        for hour,colours in schedule.schedule.items():
-            print(f"Hour : {hour}\t\t{colours}" )
-            palette = p.Palette(f"./palettes/{args.palette}",
-                                    bgr_lum=colours["bgr_lum"],
-                                    fil_lum=colours["fil_lum"],
-                                    str_lum=colours["str_lum"])
-            
-            target = deepcopy(canvas)
-            target.transform_alpha(current_alpha=star_alpha,
-                target_alpha=colours["star_al"])
-            
-            colours = palette.create_transform(background_colour=colours["bg_col"],line_colour=colours["fg_col"],squash_fill_colours=colours["squash"])
-            
-            target.transform_colours(colours)
-
-
-            os.makedirs("output/static",exist_ok=True)
-            target.export(f"output/static/constellation_{hour}.png")
+        if args.animate:
+            export_animated(scene,
+                            canvas,
+                            schedule,
+                            f"./palettes/{args.palette}",
+                            frames=args.frames,
+                            fps=args.fps,
+                            format=args.animate,
+                            depth=args.twinkle,
+                            seed=args.seed)
+        elif args.resolutions:
+            export_resolutions(scene,
+                               args.resolutions,
+                               schedule,
+                               f"./palettes/{args.palette}",
+                               jobs=args.jobs,
+                               render=args.render,
+                               cache=cache,
+                               tile_height=args.tile_height,
+                               star_renderer=args.star_renderer,
+                               glow=args.glow,
+                               glow_strength=args.glow_strength)
+        else:
+            export_static(canvas,
+                          schedule,
+                          f"./palettes/{args.palette}",
+                          star_alpha,
+                          jobs=args.jobs,
+                          render=args.render,
+                          cache=cache,
+                          tile_height=args.tile_height,
+                          glow=args.glow,
+                          glow_strength=args.glow_strength,
+                          detail=detail)
+
+        if args.profile:
+            profiler.flush("output/profile/static.json",label="static")
 
     else:
-        while(True):
-
-            now = datetime.now()
-            next = now.replace(microsecond=0, second=0, minute=0) + timedelta(hours=1)
-            delta = (next - now).total_seconds()
-
-            # If it's a new day, redo the schedule
-            if now.hour == 0:
-                schedule = s.ColourSchedule(args.lat,args.long)
-
-            colours = schedule.schedule[now.hour]
-            
-            print(f"Hour : {now.hour}\t\t{colours}" )
-            
-            target = deepcopy(canvas)
-            target.transform_alpha(current_alpha=star_alpha,
-                        target_alpha=colours["star_al"])
-
-
-            palette = p.Palette(f"./palettes/{args.palette}",
-                                    bgr_lum=colours["bgr_lum"],
-                                    fil_lum=colours["fil_lum"],
-                                    str_lum=colours["str_lum"])
-
-            colours = palette.create_transform(background_colour=colours["bg_col"],line_colour=colours["fg_col"],squash_fill_colours=colours["squash"])
-            
-            target.transform_colours(colours)
-
-            
-
-            target.export(f"output/constellation.png")            
-            abspath = os.path.abspath(f"output/constellation.png")
-
-            subprocess.call(["gsettings","set","org.gnome.desktop.background","picture-uri",
-                            f"file://{abspath}"])
-            subprocess.call(["gsettings","set","org.gnome.desktop.background","picture-uri-dark",
-                            f"file://{abspath}"])
-
-            print(f"Sleeping for {delta} seconds until {next}")
-            time.sleep(delta)
-
+        daemon = Daemon(canvas,
+                        star_alpha,
+                        f"./palettes/{args.palette}",
+                        lat,
+                        lon,
+                        render=args.render,
+                        cache=cache,
+                        profile_dir="output/profile" if args.profile else None,
+                        tile_height=args.tile_height,
+                        jobs=args.jobs,
+                        locator=locator,
+                        interval=args.interval,
+                        glow=args.glow,
+                        glow_strength=args.glow_strength,
+                        detail=detail)
+        daemon.run()
@@ -1,9 +1,10 @@
-import yaml
-import tomllib
 import json
 import os
-from colour import Color
+import numpy as np
+import profiler
+from colour import Color,hex2rgb,rgb2hex
 from copy import deepcopy
+from functools import lru_cache
 
 import colorsys as clr
 
@@ -21,6 +22,91 @@ import colorsys as clr
  
 
 
+@lru_cache(maxsize=32)
+def _load_palette(palette_file: str, mtime: float) -> dict:
+    ext = os.path.splitext(palette_file)
+    
+    # Only the parser for the palette's format is imported
+    match ext[1]:
+        case ".yaml" | ".yml":
+            import yaml
+            with open(palette_file,'r') as file:
+                return yaml.safe_load(file)
+        case ".toml":
+            import tomllib
+            with open(palette_file,'rb') as file:
+                return tomllib.load(file)
+
+
+@profiler.stage
+def load_palette(palette_file: str) -> dict:
+    """
+    Parse a palette file, at most once for as long as it isn't modified.
+    The parsed palette is shared between callers, so treat it as read-only.
+
+    Args:
+        palette_file (str): Path to a YAML or TOML (Alacritty) colour scheme
+
+    Returns:
+        dict: Parsed palette
+    """
+    return _load_palette(palette_file,os.path.getmtime(palette_file))
+
+
+def hsv_to_rgb(h: np.ndarray, s: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """
+    Vectorized colorsys.hsv_to_rgb over broadcastable arrays
+
+    Returns:
+        np.ndarray: RGB, with channels along the last axis
+    """
+    h,s,v = np.broadcast_arrays(h,s,v)
+    i = (h*6.0).astype(int)
+    f = (h*6.0) - i
+    p = v*(1.0 - s)
+    q = v*(1.0 - s*f)
+    t = v*(1.0 - s*(1.0-f))
+    i = i % 6
+
+    sectors = [(v,t,p),(q,v,p),(p,v,t),(p,q,v),(t,p,v),(v,p,q)]
+    rgb = np.zeros(h.shape + (3,))
+    for sector,channels in enumerate(sectors):
+        mask = i == sector
+        for channel in range(3):
+            rgb[...,channel][mask] = channels[channel][mask]
+
+    grey = s == 0.0
+    rgb[grey] = v[grey][...,None]
+
+    return rgb
+
+
+def build_transform(background: dict,
+                    fill: dict,
+                    stroke: dict,
+                    background_colour="black",
+                    line_colour = "white",
+                    squash_fill_colours: bool = False) -> dict:
+
+    colours = {}
+
+    for colour in Palette.magic:
+
+        hex = Palette.magic[colour]
+        match colour:
+            case "white":
+                colours[hex] = background[background_colour]
+            case "black":
+                colours[hex] = stroke[line_colour]
+            case _:
+                if squash_fill_colours:
+                    colours[hex] = stroke[line_colour]
+                else:
+                    colours[hex] = fill[colour]
+
+    return colours
+
+
 class ColorHSV(Color):
 
     @staticmethod
@@ -56,6 +142,7 @@ class Palette(dict):
         "white"     : "#ffffff"
     }
 
+    @profiler.stage
     def __init__(self,
                  palette_file: str,
                  bgr_lum : float = 0.1,
@@ -84,41 +171,82 @@ class Palette(dict):
         return f"{self.palette}"
     
 
-    def load_from_file(self,palette_file : str) -> None:
-        ext = os.path.splitext(palette_file)
-        
-        match ext[1]:
-            case "yaml" | ".yml":
-                with open(palette_file,'r') as file:
-                    return yaml.safe_load(file)
-            case ".toml":
-                with open(palette_file,'rb') as file:
-                    return tomllib.load(file)
+    def load_from_file(self,palette_file : str) -> dict:
+        return load_palette(palette_file)
 
 
+    @profiler.stage
     def create_transform(self,
                          background_colour="black",
                          line_colour = "white",
                          squash_fill_colours: bool = False) -> dict:
 
-        colours = {}
+        return build_transform({key : colour.hex for key,colour in self.background.items()},
+                               {key : colour.hex for key,colour in self.fill.items()},
+                               {key : colour.hex for key,colour in self.stroke.items()},
+                               background_colour=background_colour,
+                               line_colour=line_colour,
+                               squash_fill_colours=squash_fill_colours)
 
-        for colour in self.magic:
 
-            hex = self.magic[colour]
-            match colour:
-                case "white":
-                    colours[hex] = self.background[background_colour].hex
-                case "black":
-                    colours[hex] = self.stroke[line_colour].hex
-                case _:
-                    if squash_fill_colours:
-                        colours[hex] = self.stroke[line_colour].hex
-                    else:
-                        colours[hex] = self.fill[colour].hex
+class PaletteTable:
+
+    @profiler.stage
+    def __init__(self, palette_file: str, schedule: dict) -> None:
+        """
+        Colour transformations for every hour of a colour schedule, computed up front.
+        The background, fill and stroke variants of every palette colour are
+        derived for all hours in one vectorized pass.
+
+        Args:
+            palette_file (str): Path to the palette
+            schedule (dict): Hourly colours, as in ColourSchedule.schedule
+        """
+        colours = load_palette(palette_file)["colors"]["normal"]
+        self.names = list(colours)
+        self.hsv = np.array([ColorHSV.rgb2hsv(hex2rgb(ColorHSV(colours[name]).hex_l)) for name in self.names])
+
+        hours = list(schedule)
+        self.transforms = dict(zip(hours,self.build_transforms([schedule[hour] for hour in hours])))
+
+    def build_transforms(self, schedule: list) -> list:
+        """
+        Colour transformations for a list of hourly colours, in one vectorized pass
+
+        Args:
+            schedule (list): Hourly colours, as the values of ColourSchedule.schedule
+
+        Returns:
+            list: Colour transformations, as in Palette.create_transform
+        """
+        luminances = np.array([[colours[key] for key in ("bgr_lum","fil_lum","str_lum")] for colours in schedule],dtype=float).reshape(-1,3)
+
+        # hours x (background, fill, stroke) x colours x rgb
+        rgb = hsv_to_rgb(self.hsv[:,0],self.hsv[:,1],luminances[:,:,None])
+
+        transforms = []
+        for i,colours in enumerate(schedule):
+            background,fill,stroke = [{name : rgb2hex(rgb[i,variant,j]) for j,name in enumerate(self.names)} for variant in range(3)]
+            transforms.append(build_transform(background,
+                                              fill,
+                                              stroke,
+                                              background_colour=colours["bg_col"],
+                                              line_colour=colours["fg_col"],
+                                              squash_fill_colours=colours["squash"]))
+        return transforms
+
+    @profiler.stage
+    def transform_for(self, colours: dict) -> dict:
+        """
+        Colour transformation for colours that aren't in the table, e.g. interpolated between hours
+        """
+        return self.build_transforms([colours])[0]
+
+    @profiler.stage
+    def create_transform(self, hour: int) -> dict:
+        return self.transforms[hour]
+
 
-        return colours
-            
 
 if __name__ == "__main__":
     palette = Palette("palettes/kanagawa.yml")
@@ -0,0 +1,166 @@
+import numpy as np
+
+
+# 5x5 neighbourhood of grid cells that can hold a point closer than the minimum distance
+NEIGHBOURHOOD = [(dx,dy) for dx in range(-2,3) for dy in range(-2,3) if (dx,dy) != (0,0)]
+
+
+class StarField:
+
+    def __init__(self,
+                 width: float,
+                 height: float,
+                 sizes: tuple = (0.005,0.025),
+                 seed: int = None) -> None:
+        """
+        Batch placement engine for the star field.
+        Everything is drawn from a single seeded generator,
+        so the same seed always produces the same layout.
+
+        Args:
+            width (float): canvas width
+            height (float): canvas height
+            sizes (tuple): Smallest and largest star scale, as a fraction of the canvas
+            seed (int): Seed for the random generator. A random layout is produced if None
+        """
+        self.width = width
+        self.height = height
+        self.sizes = sizes
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+    def place(self,
+              count: int,
+              min_distance: float = 0,
+              keep_out: tuple = None,
+              candidates: int = None) -> tuple:
+        """
+        Place stars on the canvas
+
+        Args:
+            count (int): Number of stars
+            min_distance (float): Minimum distance between star centres. Uniform placement if 0
+            keep_out (tuple): (x0, y0, x1, y1) box no star centre may fall into
+            candidates (int): Number of candidate points to try, defaults to 30 per star
+
+        Returns:
+            tuple: x, y and scale arrays. There may be fewer than count stars
+            if the canvas cannot fit them at the requested spacing, or outside the keep-out box.
+        """
+        if candidates is None:
+            candidates = 30 * count
+        if min_distance > 0:
+            x,y = self.sample_poisson_disk(count,min_distance,candidates,keep_out)
+        else:
+            x,y = self.sample_uniform(count,candidates,keep_out)
+
+        scales = self.rng.uniform(self.sizes[0],self.sizes[1],len(x))
+
+        return x,y,scales
+
+    def sample_candidates(self, count: int, keep_out: tuple = None) -> tuple:
+        x = self.rng.uniform(0,self.width,count)
+        y = self.rng.uniform(0,self.height,count)
+
+        if keep_out is not None:
+            x0,y0,x1,y1 = keep_out
+            outside = (x < x0) | (x > x1) | (y < y0) | (y > y1)
+            x,y = x[outside],y[outside]
+
+        return x,y
+
+    def sample_uniform(self, count: int, candidates: int, keep_out: tuple = None) -> tuple:
+        if count == 0:
+            return np.empty(0),np.empty(0)
+        xs,ys = [],[]
+        remaining = count
+        # Rejection from the keep-out box only ever removes points, so top up until there are enough,
+        # or the candidates run out when the box covers (nearly) the whole canvas
+        while remaining > 0 and candidates > 0:
+            size = max(remaining,64)
+            candidates -= size
+            x,y = self.sample_candidates(size,keep_out)
+            xs.append(x[:remaining])
+            ys.append(y[:remaining])
+            remaining -= len(xs[-1])
+        return np.concatenate(xs),np.concatenate(ys)
+
+    def sample_poisson_disk(self,
+                            count: int,
+                            min_distance: float,
+                            candidates: int,
+                            keep_out: tuple = None,
+                            batch_size: int = 8192) -> tuple:
+        """
+        Minimum distance (Poisson-disk) sampling by dart throwing on a uniform grid.
+        The grid cell is small enough to hold at most one accepted point,
+        so each candidate only needs checking against its 5x5 cell neighbourhood.
+        Candidates are tested in batches; within a batch, a candidate loses to any earlier one it conflicts with.
+
+        Returns:
+            tuple: x and y arrays of the accepted points
+        """
+        cell = min_distance / np.sqrt(2)
+        grid_width = int(np.ceil(self.width / cell))
+        grid_height = int(np.ceil(self.height / cell))
+
+        # Pad by two cells on every side so neighbourhood lookups never go out of bounds
+        grid = np.full((grid_height + 4,grid_width + 4),-1,dtype=np.int64)
+        batch_grid = np.full_like(grid,-1)
+
+        accepted_x = np.empty(count)
+        accepted_y = np.empty(count)
+        accepted = 0
+        min_distance_sq = min_distance ** 2
+
+        while accepted < count and candidates > 0:
+            size = min(batch_size,candidates)
+            candidates -= size
+
+            x,y = self.sample_candidates(size,keep_out)
+            cx = (x / cell).astype(np.int64) + 2
+            cy = (y / cell).astype(np.int64) + 2
+
+            # Drop candidates in occupied cells, then keep the first candidate in each cell
+            free = grid[cy,cx] < 0
+            x,y,cx,cy = x[free],y[free],cx[free],cy[free]
+            _,first = np.unique(cy * grid.shape[1] + cx,return_index=True)
+            first.sort()
+            x,y,cx,cy = x[first],y[first],cx[first],cy[first]
+
+            order = np.arange(len(x))
+            batch_grid[cy,cx] = order
+            keep = np.ones(len(x),dtype=bool)
+
+            for dx,dy in NEIGHBOURHOOD:
+                neighbour = grid[cy + dy,cx + dx]
+                hit = neighbour >= 0
+                if hit.any():
+                    index = neighbour[hit]
+                    close = (accepted_x[index] - x[hit]) ** 2 + (accepted_y[index] - y[hit]) ** 2 < min_distance_sq
+                    keep[np.flatnonzero(hit)[close]] = False
+
+                neighbour = batch_grid[cy + dy,cx + dx]
+                hit = (neighbour >= 0) & (neighbour < order)
+                if hit.any():
+                    index = neighbour[hit]
+                    close = (x[index] - x[hit]) ** 2 + (y[index] - y[hit]) ** 2 < min_distance_sq
+                    keep[np.flatnonzero(hit)[close]] = False
+
+            batch_grid[cy,cx] = -1
+
+            x,y,cx,cy = x[keep],y[keep],cx[keep],cy[keep]
+            x,y,cx,cy = x[:count - accepted],y[:count - accepted],cx[:count - accepted],cy[:count - accepted]
+
+            grid[cy,cx] = np.arange(accepted,accepted + len(x))
+            accepted_x[accepted:accepted + len(x)] = x
+            accepted_y[accepted:accepted + len(x)] = y
+            accepted += len(x)
+
+        return accepted_x[:accepted],accepted_y[:accepted]
+
+
+if __name__ == "__main__":
+    field = StarField(3440,1440,seed=0)
+    x,y,scales = field.place(1000,min_distance=30)
+    print(f"Placed {len(x)} stars")
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import importlib
+import time
+import threading
+import tracemalloc
+from functools import wraps
+
+
+# Functions marked with @stage, wrapped only once profiling is enabled, so instrumentation costs nothing when off
+_stages = []
+
+# Third party hot paths, as (module, attribute path, stage name)
+EXTERNAL_STAGES = [
+    ("svgmanip","Element.__init__","svgmanip.parse"),
+    ("svgmanip","Element.tostr","svgmanip.tostr"),
+    ("cairosvg","svg2png","cairosvg.svg2png"),
+    ("artist","deepcopy","artist.deepcopy")
+]
+
+enabled = False
+
+_lock = threading.Lock()
+_current = {}
+_cumulative = {}
+_renders = 0
+
+
+def stage(function):
+    """
+    Mark a function or method as a profiled stage, named after its module and qualified name
+    """
+    # Modules imported after profiling started are wrapped as they are defined
+    if enabled:
+        return _wrap(function,_stage_name(function))
+    _stages.append(function)
+    return function
+
+
+def _stage_name(function) -> str:
+    module_name = "main" if function.__module__ == "__main__" else function.__module__
+    return f"{module_name}.{function.__qualname__}"
+
+
+def _record(name: str, seconds: float, allocated: int) -> None:
+    with _lock:
+        stats = _current.setdefault(name,{"calls" : 0, "seconds" : 0.0, "allocated_bytes" : 0})
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        stats["allocated_bytes"] += allocated
+
+
+def _wrap(function, name: str):
+
+    @wraps(function)
+    def profiled(*args, **kwargs):
+        allocated = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            return function(*args,**kwargs)
+        finally:
+            _record(name,time.perf_counter() - start,tracemalloc.get_traced_memory()[0] - allocated)
+
+    return profiled
+
+
+def _patch(owner, attribute: str, name: str) -> None:
+    value = owner.__dict__[attribute] if isinstance(owner,type) else getattr(owner,attribute)
+
+    if isinstance(value,staticmethod):
+        setattr(owner,attribute,staticmethod(_wrap(value.__func__,name)))
+    elif isinstance(value,classmethod):
+        setattr(owner,attribute,classmethod(_wrap(value.__func__,name)))
+    else:
+        setattr(owner,attribute,_wrap(value,name))
+
+
+def _resolve(module, path: str) -> tuple:
+    owner = module
+    *parents,attribute = path.split(".")
+    for parent in parents:
+        owner = getattr(owner,parent)
+
+    # Patch methods on the class that defines them, so inherited methods are found too
+    if isinstance(owner,type):
+        owner = next(cls for cls in owner.__mro__ if attribute in cls.__dict__)
+
+    return owner,attribute
+
+
+def enable() -> None:
+    """
+    Start profiling: wrap every marked stage and third party hot path,
+    and trace allocations so every stage also records its allocation delta.
+    """
+    global enabled
+    if enabled:
+        return
+    enabled = True
+
+    tracemalloc.start()
+
+    for function in _stages:
+        owner,attribute = _resolve(sys.modules[function.__module__],function.__qualname__)
+        _patch(owner,attribute,_stage_name(function))
+
+    # Lazily imported modules are imported now, so their first use is already patched
+    for module_name,path,name in EXTERNAL_STAGES:
+        owner,attribute = _resolve(importlib.import_module(module_name),path)
+        _patch(owner,attribute,name)
+
+
+def report() -> dict:
+    """
+    Stage statistics since the last flush, slowest first
+    """
+    with _lock:
+        return dict(sorted(((name,dict(stats)) for name,stats in _current.items()),
+                           key=lambda item: item[1]["seconds"],
+                           reverse=True))
+
+
+def summary() -> dict:
+    """
+    Stage statistics accumulated over every flushed render, slowest first
+    """
+    with _lock:
+        stages = dict(sorted(((name,dict(stats)) for name,stats in _cumulative.items()),
+                             key=lambda item: item[1]["seconds"],
+                             reverse=True))
+        return {"renders" : _renders, "stages" : stages}
+
+
+def flush(path: str, label: str = None) -> dict:
+    """
+    Write the statistics of the current render to a JSON report, fold them into the cumulative summary and reset them
+
+    Args:
+        path (str): Report path
+        label (str): Optional description of the render
+
+    Returns:
+        dict: The report
+    """
+    global _renders
+
+    result = {"label" : label, "stages" : report()}
+
+    with _lock:
+        for name,stats in _current.items():
+            total = _cumulative.setdefault(name,{"calls" : 0, "seconds" : 0.0, "allocated_bytes" : 0})
+            for key in total:
+                total[key] += stats[key]
+        _current.clear()
+        _renders += 1
+
+    os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+    with open(path,"w") as file:
+        json.dump(result,file,indent=4)
+
+    return result
+
+
+def dump_summary(path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+    with open(path,"w") as file:
+        json.dump(summary(),file,indent=4)
@@ -1,18 +1,55 @@
+import profiler
+import os
+import numpy as np
 from suntime import Sun,SunTimeException
-from datetime import datetime
+from datetime import datetime,timedelta,timezone
+
+
+# Sun zenith at sunrise and sunset, as used by suntime
+ZENITH = 90.8
+
+# Names of the text fields of a schedule, stored as codes in a ScheduleTable
+SCHEDULE_NAMES = {
+    "phase"     : ["night","dawn","day","dusk"],
+    "bg_col"    : ["black","white","magenta","blue"],
+    "fg_col"    : ["black","white","magenta","blue"]
+}
+SCHEDULE_FLOATS = ["bgr_lum","fil_lum","str_lum","star_al"]
+SCHEDULE_FLAGS = ["squash"]
 
 
 class ColourSchedule:
 
-    def __init__(self,lat: float, long: float) -> None:
+    @profiler.stage
+    def __init__(self,
+                 lat: float,
+                 long: float,
+                 at_date: datetime = None,
+                 sun_times: tuple = None) -> None:
+        """
+        Hourly colour schedule of a day
+
+        Args:
+            lat (float): Latitude
+            long (float): Longitude
+            at_date (datetime): Day to schedule, today if None
+            sun_times (tuple): Local (sunrise, sunset) datetimes if already known, (None, None)
+            if the sun doesn't rise or set that day. Calculated with suntime if None.
+        """
         self.lat = lat
         self.long = long
         self.tz = datetime.now().tzinfo
+        self.date = at_date if at_date is not None else datetime.now()
 
         try:
-            stime = Sun(lat,long)
-            self.sunrise = stime.get_sunrise_time().astimezone(self.tz)
-            self.sunset = stime.get_sunset_time().astimezone(self.tz)
+            if sun_times is None:
+                stime = Sun(lat,long)
+                sun_times = (stime.get_sunrise_time(self.date).astimezone(self.tz),
+                             stime.get_sunset_time(self.date).astimezone(self.tz))
+            if None in sun_times:
+                raise SunTimeException("The sun doesn't rise or set on this day")
+
+            self.sunrise,self.sunset = sun_times
             self.dawn = self.sunrise.hour
             self.dusk = self.sunset.hour
             self.daylight_hours = self.sunset.hour - self.sunrise.hour - 1
@@ -23,9 +60,9 @@ class ColourSchedule:
             self.midnight_hour = (self.sunset.hour + int(self.nighttime_hours/2)) % 24
 
         except SunTimeException:
-            if self.is_summer(lat):
-                self.sunrise = datetime.now().replace(hour=0,minute=0,second=0)
-                self.sunset = datetime.now().replace(hour=23,minute=59,second=59)
+            if self.is_summer(lat,self.date):
+                self.sunrise = self.date.replace(hour=0,minute=0,second=0)
+                self.sunset = self.date.replace(hour=23,minute=59,second=59)
                 self.dawn = 0
                 self.dusk = 23
                 self.daylight_hours = 24
@@ -36,8 +73,8 @@ class ColourSchedule:
                 self.midnight_hour = 0
 
             else:
-                self.sunrise = datetime.now().replace(hour=23,minute=59,second=59)
-                self.sunset = datetime.now().replace(hour=23,minute=59,second=59)
+                self.sunrise = self.date.replace(hour=23,minute=59,second=59)
+                self.sunset = self.date.replace(hour=23,minute=59,second=59)
                 self.dawn = 23
                 self.dusk = 0
                 self.daylight_hours = 0
@@ -214,15 +251,220 @@ class ColourSchedule:
             
     
     @staticmethod
-    def is_summer(lat: float) -> bool:
+    def is_summer(lat: float, time: datetime = None) -> bool:
 
-        time = datetime.now()
+        if time is None:
+            time = datetime.now()
 
         if time.month in range(3,9):
             return True if lat > 0 else False
         else:
             return False if lat > 0 else True
         
+def force_range(values: np.ndarray, limit: float) -> np.ndarray:
+    return np.where(values < 0,values + limit,np.where(values >= limit,values - limit,values))
+
+
+def sun_hours(lat: float, long: float, days: np.ndarray, rise: bool) -> tuple:
+    """
+    Vectorized suntime: sunrise or sunset of many days at once
+
+    Args:
+        lat (float): Latitude
+        long (float): Longitude
+        days (np.ndarray): Days of the year, 1 based
+        rise (bool): Sunrise if True, sunset otherwise
+
+    Returns:
+        tuple: Hours after UTC midnight of each day, and whether the sun rises (or sets) that day at all
+    """
+    to_rad = np.pi / 180
+    lng_hour = long / 15
+
+    t = days + ((6 if rise else 18) - lng_hour) / 24
+    M = (0.9856 * t) - 3.289
+    L = force_range(M + (1.916 * np.sin(to_rad*M)) + (0.020 * np.sin(to_rad * 2 * M)) + 282.634,360)
+
+    sin_dec = 0.39782 * np.sin(to_rad*L)
+    cos_dec = np.cos(np.arcsin(sin_dec))
+    cos_h = (np.cos(to_rad*ZENITH) - (sin_dec * np.sin(to_rad*lat))) / (cos_dec * np.cos(to_rad*lat))
+    valid = np.abs(cos_h) <= 1
+
+    H = np.degrees(np.arccos(np.clip(cos_h,-1,1)))
+    H = (360 - H if rise else H) / 15
+
+    RA = force_range(np.degrees(np.arctan(0.91764 * np.tan(to_rad*L))),360)
+    RA = (RA + (np.floor(L/90)*90 - np.floor(RA/90)*90)) / 15
+
+    UT = force_range(np.round(H + RA - (0.06571 * t) - 6.622 - lng_hour,2),24)
+    utc_day_offset = -np.floor((UT + lng_hour) / 24)
+
+    return UT + 24*utc_day_offset,valid
+
+
+def interpolate_colours(current: dict, following: dict, fraction: float) -> dict:
+    """
+    Blend the colours of an hour towards the next one
+
+    Args:
+        current (dict): Colours of the hour, as in ColourSchedule.schedule
+        following (dict): Colours of the next hour
+        fraction (float): How far into the hour (0->1)
+
+    Returns:
+        dict: Colours with the luminances and star alpha blended.
+        Phase, colour names and squashing are the current hour's.
+    """
+    colours = dict(current)
+    for name in SCHEDULE_FLOATS:
+        colours[name] = current[name] + (following[name] - current[name]) * fraction
+    return colours
+
+
+class ScheduleTable:
+
+    def __init__(self, lat: float, long: float, year: int, fields: dict) -> None:
+        """
+        Colour schedules of every day of a year, as flat arrays. A day points at one of
+        a few distinct hourly schedules, so looking up the colours of any hour is a couple of array reads.
+        Build one with ScheduleTable.build, or load one with ScheduleTable.cached.
+
+        Args:
+            lat (float): Latitude
+            long (float): Longitude
+            year (int): Year
+            fields (dict): Arrays, see build
+        """
+        self.lat = lat
+        self.long = long
+        self.year = year
+        self.fields = fields
+        self.index = fields["index"]
+        self._schedules = {}
+
+    @classmethod
+    @profiler.stage
+    def build(cls, lat: float, long: float, year: int) -> "ScheduleTable":
+        """
+        Work out the sunrise and sunset of every day of a year in one vectorized pass,
+        and the hourly colours of every distinct (sunrise hour, sunset hour) combination.
+        """
+        days = np.arange(1,(datetime(year + 1,1,1) - datetime(year,1,1)).days + 1)
+        midnights = [datetime(year,1,1,tzinfo=timezone.utc) + timedelta(days=int(day) - 1) for day in days]
+
+        times = []
+        for rise in (True,False):
+            hours,valid = sun_hours(lat,long,days,rise)
+            times.append((hours,valid))
+        valid = times[0][1] & times[1][1]
+
+        keys = {}
+        index = np.zeros(len(days),dtype=np.uint16)
+        sunrise = np.full(len(days),-1,dtype=np.int64)
+        sunset = np.full(len(days),-1,dtype=np.int64)
+        schedules = []
+
+        for i,midnight in enumerate(midnights):
+            date = datetime(year,1,1) + timedelta(days=i)
+            if valid[i]:
+                sun_times = tuple((midnight + timedelta(hours=float(hours[i]))).astimezone() for hours,_ in times)
+                sunrise[i],sunset[i] = [int(time.timestamp()) for time in sun_times]
+                key = tuple(time.hour for time in sun_times)
+            else:
+                sun_times = (None,None)
+                key = ColourSchedule.is_summer(lat,date)
+
+            if key not in keys:
+                keys[key] = len(schedules)
+                schedules.append(ColourSchedule(lat,long,date,sun_times).schedule)
+            index[i] = keys[key]
+
+        fields = {"index" : index, "sunrise" : sunrise, "sunset" : sunset, "utc_offsets" : cls.utc_offsets(year)}
+        for name,values in SCHEDULE_NAMES.items():
+            fields[name] = np.array([[values.index(day[hour][name]) for hour in range(24)] for day in schedules],dtype=np.uint8)
+        for name in SCHEDULE_FLOATS:
+            fields[name] = np.array([[day[hour][name] for hour in range(24)] for day in schedules],dtype=np.float64)
+        for name in SCHEDULE_FLAGS:
+            fields[name] = np.array([[day[hour][name] for hour in range(24)] for day in schedules],dtype=bool)
+
+        return cls(lat,long,year,fields)
+
+    @staticmethod
+    def utc_offsets(year: int) -> np.ndarray:
+        """
+        Local UTC offset at noon of every day of a year in minutes, which the table is only valid for
+        """
+        start = datetime(year,1,1,12)
+        days = (datetime(year + 1,1,1) - datetime(year,1,1)).days
+        return np.array([(start + timedelta(days=day)).astimezone().utcoffset().total_seconds() // 60 for day in range(days)],dtype=np.int16)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+        temporary = f"{path}.tmp.npz"
+        np.savez_compressed(temporary,lat=self.lat,long=self.long,year=self.year,**self.fields)
+        os.replace(temporary,path)
+
+    @classmethod
+    def load(cls, path: str) -> "ScheduleTable":
+        with np.load(path) as data:
+            fields = {name : data[name] for name in data.files if name not in ["lat","long","year"]}
+            return cls(float(data["lat"]),float(data["long"]),int(data["year"]),fields)
+
+    @classmethod
+    @profiler.stage
+    def cached(cls, lat: float, long: float, year: int, directory: str = "output/schedules") -> "ScheduleTable":
+        """
+        Load the table of a location and year, building and saving it first if it's missing
+        or was built for different UTC offsets (another time zone)
+        """
+        path = os.path.join(directory,f"{lat:.4f}_{long:.4f}_{year}.npz")
+        if os.path.exists(path):
+            table = cls.load(path)
+            if np.array_equal(table.fields["utc_offsets"],cls.utc_offsets(year)):
+                return table
+
+        table = cls.build(lat,long,year)
+        table.save(path)
+        return table
+
+    def day(self, when: datetime) -> int:
+        if when.year != self.year:
+            raise ValueError(f"{when} is outside the {self.year} schedule table")
+        return int(self.index[when.timetuple().tm_yday - 1])
+
+    def colours(self, when: datetime) -> dict:
+        """
+        Colours of the hour of a given time, as in ColourSchedule.schedule
+        """
+        return self.schedule(when)[when.hour]
+
+    def interpolated(self, when: datetime) -> dict:
+        """
+        Colours at a given time, blended between its hour and the next one down to the second
+        """
+        following = when + timedelta(hours=1)
+        # Past the end of the year there's nothing to blend towards, so hold the last hour
+        following = self.colours(following) if following.year == self.year else self.colours(when)
+        fraction = (when.minute * 60 + when.second) / 3600
+        return interpolate_colours(self.colours(when),following,fraction)
+
+    def schedule(self, when: datetime) -> dict:
+        """
+        Hourly colours of the day of a given time, as in ColourSchedule.schedule
+        """
+        day = self.day(when)
+        if day not in self._schedules:
+            self._schedules[day] = {
+                hour : {
+                    **{name : values[self.fields[name][day,hour]] for name,values in SCHEDULE_NAMES.items()},
+                    **{name : float(self.fields[name][day,hour]) for name in SCHEDULE_FLOATS},
+                    **{name : bool(self.fields[name][day,hour]) for name in SCHEDULE_FLAGS}
+                }
+                for hour in range(24)
+            }
+        return self._schedules[day]
+
+
 if __name__ == "__main__":
     schedule = ColourSchedule(0,0)
     print(schedule)
\ No newline at end of file
@@ -0,0 +1,296 @@
+import artist as a
+import cache as ch
+import schedule as s
+import worker as w
+import os
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from collections import deque
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from urllib.parse import urlparse,parse_qs
+
+
+CONSTELLATION_DIR = "resources/constellations"
+PALETTE_DIR = "palettes"
+
+MAX_SIZE = 16384
+
+
+def render(constellation: str, palette: str, colours: dict, width: int, height: int) -> bytes:
+    """
+    Render one wallpaper in a worker
+
+    Returns:
+        bytes: PNG
+    """
+    template = w.load_template(constellation,width,height)
+    transform = w.load_palettes(palette).transform_for(colours)
+    return a.rasterize(template.render(transform,colours["star_al"]),None,width,height)
+
+
+class RequestError(ValueError):
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class RenderService:
+
+    def __init__(self,
+                 settings: dict,
+                 lat: float = 0,
+                 lon: float = 0,
+                 workers: int = 1,
+                 max_bytes: int = 64 * 1024**2,
+                 timeout: float = 120,
+                 window: int = 1000) -> None:
+        """
+        Renders wallpapers on request. Recent PNGs are kept in a bounded in-memory LRU, concurrent
+        requests for the same wallpaper wait on a single render, and renders run on a pool of worker
+        processes that each keep their parsed scenes and palettes.
+
+        Args:
+            settings (dict): Render settings shared by every request, sent to every worker once (see worker.init)
+            lat (float): Latitude for the colour schedule
+            lon (float): Longitude for the colour schedule
+            workers (int): Number of worker processes
+            max_bytes (int): Size bound of the in-memory cache
+            timeout (float): Seconds a request waits for its render
+            window (int): Number of recent requests latencies are reported over
+        """
+        self.settings = settings
+        self.lat = lat
+        self.lon = lon
+        self.timeout = timeout
+
+        self.pool = ProcessPoolExecutor(max_workers=workers,initializer=w.init,initargs=(settings,))
+        self.cache = ch.MemoryCache(max_bytes)
+        self.table = s.ScheduleTable.cached(lat,lon,datetime.now().year)
+
+        self.constellations = {os.path.splitext(name)[0] for name in os.listdir(CONSTELLATION_DIR) if name.endswith(".svg")}
+        self.palettes = {name for name in os.listdir(PALETTE_DIR) if name.endswith((".yml",".yaml",".toml"))}
+
+        # Renders in progress, by cache key
+        self.in_flight = {}
+        self.lock = threading.RLock()
+
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.renders = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=window)
+        self.render_seconds = deque(maxlen=window)
+
+    def colours(self, hour: int) -> dict:
+        """
+        Today's colours for an hour
+        """
+        now = datetime.now()
+        with self.lock:
+            if self.table.year != now.year:
+                self.table = s.ScheduleTable.cached(self.lat,self.lon,now.year)
+            return self.table.schedule(now)[hour]
+
+    def parse(self, query: dict) -> tuple:
+        """
+        Validate the parameters of a wallpaper request
+
+        Returns:
+            tuple: constellation, palette, hour, width, height
+
+        Raises:
+            RequestError: On unknown assets or malformed parameters
+        """
+        def value(name,default=None):
+            values = query.get(name)
+            if not values:
+                if default is None:
+                    raise RequestError(400,f"Missing parameter : {name}")
+                return default
+            return values[0]
+
+        constellation = value("constellation")
+        palette = value("palette","kanagawa.yml")
+        if constellation not in self.constellations:
+            raise RequestError(404,f"Unknown constellation : {constellation}")
+        if palette not in self.palettes:
+            raise RequestError(404,f"Unknown palette : {palette}")
+
+        try:
+            hour = int(value("hour",str(datetime.now().hour)))
+            width = int(value("width","3440"))
+            height = int(value("height","1440"))
+        except ValueError as e:
+            raise RequestError(400,f"Malformed parameter : {e}")
+        if not 0 <= hour < 24:
+            raise RequestError(400,f"Hour out of range : {hour}")
+        if not (0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE):
+            raise RequestError(400,f"Size out of range : {width}x{height}")
+
+        return constellation,palette,hour,width,height
+
+    def wallpaper(self, constellation: str, palette: str, hour: int, width: int, height: int) -> bytes:
+        """
+        A wallpaper from the cache, a render already in progress, or a fresh render
+
+        Returns:
+            bytes: PNG
+        """
+        colours = self.colours(hour)
+        key = ch.RenderCache.key(constellation,palette,colours,width,height,self.settings)
+
+        with self.lock:
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+
+            future = self.in_flight.get(key)
+            if future is None:
+                self.renders += 1
+                future = self.pool.submit(render,constellation,palette,colours,width,height)
+                self.in_flight[key] = future
+                future.add_done_callback(partial(self.finish,key,time.perf_counter()))
+            else:
+                self.coalesced += 1
+
+        return future.result(self.timeout)
+
+    def finish(self, key: str, started: float, future) -> None:
+        with self.lock:
+            # Cached before it stops being in flight, so no request can miss both
+            if future.exception() is None:
+                self.cache.store(key,future.result())
+            del self.in_flight[key]
+            self.render_seconds.append(time.perf_counter() - started)
+
+    def record(self, seconds: float, failed: bool = False) -> None:
+        with self.lock:
+            self.requests += 1
+            self.errors += failed
+            self.latencies.append(seconds)
+
+    def stats(self) -> dict:
+        with self.lock:
+            uptime = time.perf_counter() - self.started
+            latencies = np.array(self.latencies)
+            render_seconds = np.array(self.render_seconds)
+            return {
+                "uptime"        : uptime,
+                "requests"      : self.requests,
+                "renders"       : self.renders,
+                "coalesced"     : self.coalesced,
+                "errors"        : self.errors,
+                "in_flight"     : len(self.in_flight),
+                "throughput"    : self.requests / uptime,
+                "latency"       : {
+                    "mean"  : float(latencies.mean()) if len(latencies) else None,
+                    "p50"   : float(np.percentile(latencies,50)) if len(latencies) else None,
+                    "p95"   : float(np.percentile(latencies,95)) if len(latencies) else None,
+                    "max"   : float(latencies.max()) if len(latencies) else None
+                },
+                "render_seconds": float(render_seconds.mean()) if len(render_seconds) else None,
+                "cache"         : self.cache.stats()
+            }
+
+    def close(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        url = urlparse(self.path)
+
+        match url.path:
+            case "/wallpaper":
+                start = time.perf_counter()
+                try:
+                    data = service.wallpaper(*service.parse(parse_qs(url.query)))
+                except RequestError as e:
+                    service.record(time.perf_counter() - start,failed=True)
+                    return self.send_json({"error" : str(e)},e.status)
+                except Exception as e:
+                    service.record(time.perf_counter() - start,failed=True)
+                    return self.send_json({"error" : f"Render failed : {e}"},500)
+                service.record(time.perf_counter() - start)
+                self.send(data,"image/png")
+            case "/stats":
+                self.send_json(service.stats())
+            case _:
+                self.send_json({"error" : f"Not found : {url.path}"},404)
+
+    def send(self, data: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type",content_type)
+        self.send_header("Content-Length",str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, body: dict, status: int = 200) -> None:
+        self.send(json.dumps(body,indent=4).encode(),"application/json",status)
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:
+            super().log_message(format,*args)
+
+
+def serve(service: RenderService, host: str = "127.0.0.1", port: int = 8620, quiet: bool = False) -> ThreadingHTTPServer:
+    """
+    HTTP server for a render service. Call serve_forever() on it, or run that in a thread.
+
+    GET /wallpaper?constellation=<name>&palette=<file>&hour=<0-23>&width=<px>&height=<px>
+    returns a PNG; palette, hour (the current one), width and height are optional.
+    GET /stats returns request, cache and latency counters as JSON.
+    """
+    server = ThreadingHTTPServer((host,port),Handler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve wallpapers over HTTP, e.g. GET /wallpaper?constellation=orion&hour=21")
+
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",default=8620,type=int)
+    parser.add_argument("-s","--scale",default=0.7,type=float)
+    parser.add_argument("-n","--star-count",default=50,type=int)
+    parser.add_argument("--seed",default=0,type=int)
+    parser.add_argument("--lat",default=0,type=float)
+    parser.add_argument("--lon",default=0,type=float)
+    parser.add_argument("-j","--jobs",default=os.cpu_count(),type=int)
+    parser.add_argument("--cache-size",default=64,type=int,help="In-memory cache size in MB")
+    parser.add_argument("-q","--quiet",action="store_true",help="Don't log every request")
+
+    args = parser.parse_args()
+
+    settings = {
+        "scale"         : args.scale,
+        "star_count"    : args.star_count,
+        "star_alpha"    : 0.5,
+        "seed"          : args.seed,
+        "palette_dir"   : PALETTE_DIR
+    }
+
+    service = RenderService(settings,args.lat,args.lon,workers=args.jobs,max_bytes=args.cache_size * 1024**2)
+    server = serve(service,args.host,args.port,quiet=args.quiet)
+    print(f"Serving on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,154 @@
+import artist as a
+import compositor as c
+import profiler
+import numpy as np
+
+
+# Most pixels stamped per batch, which bounds the size of the index arrays
+BATCH_PIXELS = 1 << 22
+
+# Coverage of fully covered sprite pixels, short of 1 so the transmittance has a logarithm
+MAX_COVERAGE = 1 - 1 / 4096
+
+
+class Sprite:
+
+    def __init__(self, masks: c.LayerMasks, centre: tuple) -> None:
+        """
+        A star rasterized at one size
+
+        Args:
+            masks (c.LayerMasks): Coverage and colour masks of the star, rendered opaque
+            centre (tuple): x, y of the star's centre within the sprite, in pixels
+        """
+        self.masks = masks
+        self.centre = centre
+
+    @property
+    def shape(self) -> tuple:
+        return self.masks.coverage.shape
+
+
+class StarStamper:
+
+    def __init__(self, scene, levels: int = 16) -> None:
+        """
+        Raster backend for the detail layer. The star is rasterized at a ladder of sizes once per canvas size,
+        and every star is stamped from the closest size straight into a pixel buffer,
+        without going through the SVG. Sizes are spaced geometrically, so with 16 of them
+        no star is drawn more than a few percent too big or small, and positions are rounded to whole pixels.
+
+        Args:
+            scene (main.Scene): Scene to stamp the stars of
+            levels (int): Number of sprite sizes
+        """
+        self.scene = scene
+        self.levels = levels
+
+        # Size ladder across every possible star size, as a fraction of the canvas, so it doesn't depend on the layout
+        self.ladder = np.geomspace(*scene.star_sizes,levels)
+        # Sprites already rasterized, by scale factor, so canvases of the same size share them
+        self.sprites = {}
+
+    @profiler.stage
+    def render_sprite(self, factor: float) -> Sprite:
+        """
+        Rasterize the star at a scale factor, with a pixel of margin around its bounding box
+        """
+        star = self.scene.star
+        bx0,by0,bx1,by1 = self.scene.star_asset.bbox
+        x = 1 - factor*bx0
+        y = 1 - factor*by0
+        width = int(np.ceil(factor*(bx1 - bx0))) + 2
+        height = int(np.ceil(factor*(by1 - by0))) + 2
+
+        canvas = a.Canvas(width,height)
+        canvas.place_instances(star,[(x,y,factor,self.scene.star_alpha)])
+        masks = c.rasterize_masks(canvas.dumps_layer("detail"),width,height,self.scene.star_alpha,opaque_stars=True)
+
+        return Sprite(masks,(x + factor*star.width/2,y + factor*star.height/2))
+
+    @profiler.stage
+    def stamp(self, canvas: a.Canvas) -> c.LayerMasks:
+        """
+        Rasterize the scene's stars for a canvas, as the compositor's detail layer (stars opaque)
+
+        Overlapping stars multiply their transmittance, so coverage is exact whatever order they land in.
+        Where stars overlap, each colour takes its share of their combined coverage.
+
+        Args:
+            canvas (a.Canvas): Canvas the rest of the scene is drawn on, for its size
+
+        Returns:
+            c.LayerMasks: Detail layer
+        """
+        width,height = canvas.width,canvas.height
+        xs,ys,scales,factors = self.scene.star_layout(canvas)
+        if len(factors) == 0:
+            return c.LayerMasks(np.zeros((height,width),dtype=np.uint8),{})
+
+        # Closest size, on a log scale
+        level = np.abs(np.log(scales[:,None] / self.ladder[None,:])).argmin(axis=1)
+        ladder = self.ladder * canvas.get_scale_factor(self.scene.star,1)
+
+        centres_x = xs + factors * self.scene.star.width / 2
+        centres_y = ys + factors * self.scene.star.height / 2
+
+        # Only the sizes some star uses, each rasterized the first time a canvas of this size needs it
+        sprites = {}
+        for index in np.unique(level).tolist():
+            if ladder[index] not in self.sprites:
+                self.sprites[ladder[index]] = self.render_sprite(ladder[index])
+            sprites[index] = self.sprites[ladder[index]]
+
+        # Padded, so stars hanging over the edges need no clipping
+        pad = max(max(sprite.shape) for sprite in sprites.values())
+        padded_width = width + 2*pad
+        size = (height + 2*pad) * padded_width
+
+        planes = {"transmittance" : np.zeros(size), "coverage" : np.zeros(size)}
+
+        for index,sprite in sprites.items():
+            stars = level == index
+            left = np.rint(centres_x[stars] - sprite.centre[0]).astype(np.int64) + pad
+            top = np.rint(centres_y[stars] - sprite.centre[1]).astype(np.int64) + pad
+            inside = (left >= 0) & (top >= 0) & (left + sprite.shape[1] <= padded_width) & (top + sprite.shape[0] <= height + 2*pad)
+            origins = (top * padded_width + left)[inside]
+
+            rows,columns = np.nonzero(sprite.masks.coverage)
+            if len(origins) == 0 or len(rows) == 0:
+                continue
+            offsets = rows * padded_width + columns
+            sprite_coverage = np.minimum(sprite.masks.coverage[rows,columns] / 255,MAX_COVERAGE)
+            weights = {"transmittance" : np.log1p(-sprite_coverage), "coverage" : sprite_coverage}
+            weights.update({colour : mask[rows,columns] / 255 for colour,mask in sprite.masks.masks.items()})
+
+            batch = max(BATCH_PIXELS // len(offsets),1)
+            tiled = {name : np.tile(values,min(batch,len(origins))) for name,values in weights.items()}
+            for start in range(0,len(origins),batch):
+                indices = (origins[start:start + batch,None] + offsets[None,:]).ravel()
+                # Sum over the pixels the batch touches only, then add those into the planes
+                touched,inverse = np.unique(indices,return_inverse=True)
+                for name,values in tiled.items():
+                    plane = planes.get(name)
+                    if plane is None:
+                        plane = planes[name] = np.zeros(size)
+                    plane[touched] += np.bincount(inverse,values[:len(indices)],minlength=len(touched))
+
+        # Only the pixels under a star that land on the canvas need finishing
+        covered = np.flatnonzero(planes["coverage"])
+        rows,columns = np.divmod(covered,padded_width)
+        rows -= pad
+        columns -= pad
+        visible = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+        covered,pixels = covered[visible],rows[visible] * width + columns[visible]
+
+        total = 1 - np.exp(planes.pop("transmittance")[covered])
+        share = total / planes.pop("coverage")[covered]
+
+        def finish(values):
+            plane = np.zeros(height * width,dtype=np.uint8)
+            plane[pixels] = np.clip(values * 255 + 0.5,0,255)
+            return plane.reshape(height,width)
+
+        return c.LayerMasks(finish(total),{colour : finish(plane[covered] * share) for colour,plane in planes.items()})
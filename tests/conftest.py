@@ -0,0 +1,33 @@
+import os
+import sys
+import pytest
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+import artist as a
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    # Assets and palettes are loaded relative to the repository root
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture
+def blank_rasterize(monkeypatch):
+    """
+    Replace cairosvg with a transparent PNG of the requested size, so tests don't need cairo
+    """
+    def rasterize(svg_string,path,width,height):
+        buffer = BytesIO()
+        Image.fromarray(np.zeros((height,width,4),dtype=np.uint8),"RGBA").save(buffer,"PNG")
+        if path is None:
+            return buffer.getvalue()
+        with open(path,"wb") as file:
+            file.write(buffer.getvalue())
+
+    monkeypatch.setattr(a,"rasterize",rasterize)
@@ -0,0 +1,42 @@
+import main
+import os
+import subprocess
+import tracemalloc
+from datetime import datetime,timedelta
+
+
+CYCLES = 240
+
+
+def test_daemon_memory_and_svg_size_stay_flat(tmp_path,monkeypatch,blank_rasterize):
+    canvas = main.draw(64,48,0.7,10,0.5,"canis-major",seed=0)
+    palette = os.path.abspath("palettes/kanagawa.yml")
+
+    # Schedule tables and wallpapers are written relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(subprocess,"call",lambda *args,**kwargs: 0)
+    daemon = main.Daemon(canvas,0.5,palette,0,0,output_dir=str(tmp_path / "wallpapers"))
+
+    start = datetime.now().replace(month=1,day=1,hour=0,minute=0,second=0,microsecond=0)
+    sizes = set()
+    peaks = []
+    retained = []
+
+    tracemalloc.start()
+    try:
+        for day in range(CYCLES // 24):
+            tracemalloc.reset_peak()
+            for hour in range(24):
+                daemon.switch(daemon.render(start + timedelta(days=day,hours=hour)))
+                sizes.add(len(canvas.dumps()))
+            current,peak = tracemalloc.get_traced_memory()
+            retained.append(current)
+            peaks.append(peak)
+    finally:
+        tracemalloc.stop()
+
+    # Every cycle serializes the same canvas, and later days hold and need no more memory than the first
+    assert len(sizes) == 1
+    assert max(retained[1:]) - retained[0] < 16 * 1024
+    assert max(peaks[1:]) <= peaks[0] * 1.1
+    assert len(os.listdir(tmp_path / "wallpapers")) == 1
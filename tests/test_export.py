@@ -0,0 +1,21 @@
+import cache as ch
+import main
+import schedule as s
+import os
+from datetime import datetime
+
+
+def test_export_static_duplicates_outlive_eviction(tmp_path,blank_rasterize):
+    # Night hours share their colours, so several hours copy one render
+    day = datetime(2026,6,21)
+    schedule = s.ColourSchedule(0,0,day,sun_times=(day.replace(hour=6,minute=10),day.replace(hour=18,minute=20)))
+    canvas = main.draw(64,48,0.7,10,0.5,"canis-major",seed=0)
+
+    # Holds a single render, so every store evicts the one before
+    cache = ch.RenderCache(str(tmp_path / "cache"),max_bytes=1)
+    manifest = main.export_static(canvas,schedule,"palettes/kanagawa.yml",0.5,output_dir=str(tmp_path / "static"),cache=cache)
+
+    assert len(manifest["hours"]) == 24
+    for hour in manifest["hours"]:
+        assert os.path.getsize(tmp_path / "static" / hour["path"]) > 0
+    assert cache.stats()["evictions"] > 0
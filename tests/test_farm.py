@@ -0,0 +1,81 @@
+import artist as a
+import farm
+import schedule as s
+import json
+import pytest
+from datetime import datetime
+
+
+def farm_settings(seed: int = 0) -> dict:
+    day = datetime(2026,6,21)
+    return {
+        "width"         : 64,
+        "height"        : 48,
+        "scale"         : 0.7,
+        "star_count"    : 10,
+        "star_alpha"    : 0.5,
+        "seed"          : seed,
+        "lat"           : 0,
+        "lon"           : 0,
+        "palette_dir"   : "palettes",
+        "schedule"      : s.ColourSchedule(0,0,day,sun_times=(day.replace(hour=6),day.replace(hour=18))).schedule
+    }
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def interrupt_after(monkeypatch,blank_rasterize):
+    """
+    Make the rasterizer stop the run once it has rendered a number of images
+    """
+    rasterize = a.rasterize
+
+    def interrupt(count):
+        rendered = []
+
+        def counting(svg_string,path,width,height):
+            if len(rendered) == count:
+                raise Interrupted
+            rendered.append(path)
+            return rasterize(svg_string,path,width,height)
+
+        monkeypatch.setattr(a,"rasterize",counting)
+        return rendered
+
+    return interrupt
+
+
+def test_interrupted_run_resumes(tmp_path,interrupt_after):
+    jobs = farm.job_matrix(["canis-major"],["kanagawa.yml"],list(range(12)),str(tmp_path))
+    manifest_path = str(tmp_path / "manifest.json")
+
+    interrupt_after(4)
+    with pytest.raises(Interrupted):
+        farm.run(jobs,farm_settings(),manifest_path=manifest_path)
+
+    rendered = interrupt_after(100)
+    manifest = farm.run(jobs,farm_settings(),manifest_path=manifest_path)
+
+    assert (manifest["skipped"],manifest["rendered"]) == (4,8)
+    assert len(rendered) == 8
+    with open(manifest_path) as file:
+        assert len(json.load(file)["jobs"]) == 12
+
+
+def test_subset_runs_add_up(tmp_path,interrupt_after):
+    manifest_path = str(tmp_path / "manifest.json")
+    rendered = interrupt_after(100)
+
+    for hours in ([0,1],[2]):
+        farm.run(farm.job_matrix(["canis-major"],["kanagawa.yml"],hours,str(tmp_path)),farm_settings(),manifest_path=manifest_path)
+    manifest = farm.run(farm.job_matrix(["canis-major"],["kanagawa.yml"],[0,1,2],str(tmp_path)),farm_settings(),manifest_path=manifest_path)
+
+    assert (manifest["skipped"],manifest["rendered"]) == (3,0)
+    assert len(rendered) == 3
+
+    # Other settings render again
+    manifest = farm.run(farm.job_matrix(["canis-major"],["kanagawa.yml"],[0,1,2],str(tmp_path)),farm_settings(seed=1),manifest_path=manifest_path)
+    assert manifest["rendered"] == 3
@@ -0,0 +1,93 @@
+import location as l
+import json
+import time
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        self.server.requests.append(self.path)
+        match self.path:
+            case "/ip":
+                body = {"ip" : "203.0.113.7"}
+            case "/location/203.0.113.7":
+                body = {"lat" : 51.5, "lon" : -0.1, "city" : "London"}
+            case _:
+                self.send_response(500)
+                self.end_headers()
+                return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def stub():
+    """
+    Local stand-in for the IP and location services
+    """
+    server = ThreadingHTTPServer(("127.0.0.1",0),StubHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever,args=(0.05,),daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def locator(stub, cache_path, **kwargs) -> l.Locator:
+    base = f"http://127.0.0.1:{stub.server_address[1]}"
+    return l.Locator(str(cache_path),ip_url=f"{base}/ip",location_url=f"{base}/location/{{ip}}",timeout=2,**kwargs)
+
+
+def test_lookup_is_cached(stub,tmp_path):
+    cache_path = tmp_path / "location.json"
+
+    assert locator(stub,cache_path).location() == (51.5,-0.1)
+    with open(cache_path) as file:
+        cached = json.load(file)
+    assert (cached["lat"],cached["lon"],cached["city"]) == (51.5,-0.1,"London")
+
+    # A fresh cache is used without asking the services again
+    requests = len(stub.requests)
+    fresh = locator(stub,cache_path)
+    fresh.start()
+    assert fresh.location(wait=0) == (51.5,-0.1)
+    assert len(stub.requests) == requests
+
+
+@pytest.mark.parametrize("cached",[{"lat" : 1}, {"lat" : "1", "lon" : 2}, {"lat" : True, "lon" : 2}, [1,2], "null"])
+def test_malformed_cache_is_looked_up_again(stub,tmp_path,cached):
+    cache_path = tmp_path / "location.json"
+    with open(cache_path,"w") as file:
+        file.write(cached if isinstance(cached,str) else json.dumps(cached))
+
+    assert locator(stub,cache_path).location() == (51.5,-0.1)
+    assert "/ip" in stub.requests
+
+
+def test_stale_cache_is_used_while_refreshing(stub,tmp_path):
+    cache_path = tmp_path / "location.json"
+    with open(cache_path,"w") as file:
+        json.dump({"lat" : 10, "lon" : 20, "time" : time.time() - 7200},file)
+
+    stale = locator(stub,cache_path,ttl=3600)
+    stale.start()
+    assert stale.location(wait=0) in ((10,20),(51.5,-0.1))
+    stale.thread.join(5)
+    assert stale.location(wait=0) == (51.5,-0.1)
+
+
+def test_failed_lookup_falls_back_to_default(stub,tmp_path):
+    base = f"http://127.0.0.1:{stub.server_address[1]}"
+    failing = l.Locator(str(tmp_path / "location.json"),ip_url=f"{base}/missing",timeout=2,retry_interval=3600,default=(1,2))
+    assert failing.location() == (1,2)
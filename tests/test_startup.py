@@ -0,0 +1,8 @@
+import benchmark
+
+
+def test_import_main_within_budget():
+    result = benchmark.import_time("main",repeat=3)
+
+    assert result["seconds"] <= benchmark.STARTUP_BUDGET
+    assert [module for module in benchmark.LAZY_MODULES if module in result["modules"]] == []
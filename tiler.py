@@ -0,0 +1,221 @@
+import artist as a
+import profiler
+import zlib
+import struct
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from collections import deque
+from lxml.etree import XML,tostring
+from concurrent.futures import ProcessPoolExecutor
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def filter_rows(rows: np.ndarray) -> bytes:
+    """
+    PNG scanlines of HxWx4 uint8 RGBA rows, with the Sub filter: every byte minus the same channel of the pixel to its left
+    """
+    filtered = rows.copy()
+    filtered[:,1:] -= rows[:,:-1]
+
+    scanlines = np.empty((len(rows),1 + rows.shape[1]*4),dtype=np.uint8)
+    scanlines[:,0] = 1
+    scanlines[:,1:] = filtered.reshape(len(rows),-1)
+    return scanlines.tobytes()
+
+
+class PNGWriter:
+
+    def __init__(self, path: str, width: int, height: int, compression: int = 6) -> None:
+        """
+        Streaming RGBA PNG encoder. Rows are filtered, compressed and written
+        as they arrive, so the full image never has to be held in memory.
+
+        Args:
+            path (str): Output path
+            width (int): Image width
+            height (int): Image height
+            compression (int): zlib compression level
+        """
+        self.file = open(path,"wb")
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.compressor = zlib.compressobj(compression)
+
+        self.file.write(PNG_SIGNATURE)
+        # 8 bits per channel, colour type 6 (RGBA), default compression, filtering and no interlacing
+        self.write_chunk(b"IHDR",struct.pack(">IIBBBBB",width,height,8,6,0,0,0))
+
+    def __enter__(self) -> "PNGWriter":
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the error to propagate, rather than replacing it with a complaint about missing rows
+            self.file.close()
+
+    def write_chunk(self, kind: bytes, data: bytes) -> None:
+        self.file.write(struct.pack(">I",len(data)))
+        self.file.write(kind)
+        self.file.write(data)
+        self.file.write(struct.pack(">I",zlib.crc32(kind + data) & 0xffffffff))
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """
+        Append rows to the image
+
+        Args:
+            rows (np.ndarray): HxWx4 uint8 RGBA rows
+        """
+        compressed = self.compressor.compress(filter_rows(rows))
+        if compressed:
+            self.write_chunk(b"IDAT",compressed)
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.write_chunk(b"IDAT",self.compressor.flush())
+        self.write_chunk(b"IEND",b"")
+        self.file.close()
+        if self.rows != self.height:
+            raise ValueError(f"Wrote {self.rows} rows into a PNG of height {self.height}")
+
+
+class APNGWriter(PNGWriter):
+
+    def __init__(self, path: str, width: int, height: int, frames: int, fps: float, compression: int = 6) -> None:
+        """
+        Streaming animated PNG encoder, looping forever. Frames are compressed and written
+        as they arrive, so only one frame has to be held in memory.
+
+        Args:
+            path (str): Output path
+            width (int): Image width
+            height (int): Image height
+            frames (int): Number of frames that will be written
+            fps (float): Frames per second
+            compression (int): zlib compression level
+        """
+        super().__init__(path,width,height,compression)
+        self.compression = compression
+        self.frames = frames
+        self.written = 0
+        self.sequence = 0
+        # Frame delay as a fraction of a second
+        self.delay = (1000,round(1000 * fps))
+
+        self.write_chunk(b"acTL",struct.pack(">II",frames,0))
+
+    def write_frame(self, image: np.ndarray, blend: bool = False) -> None:
+        """
+        Append a frame
+
+        Args:
+            image (np.ndarray): HxWx4 uint8 RGBA frame, the size of the image
+            blend (bool): Draw the frame over the previous one rather than replacing it,
+            so transparent pixels keep the previous frame's (which compress to next to nothing)
+        """
+        # Full size frame at the origin, left in place for the next one
+        self.write_chunk(b"fcTL",struct.pack(">IIIIIHHBB",self.sequence,self.width,self.height,0,0,*self.delay,0,int(blend)))
+        self.sequence += 1
+
+        data = zlib.compress(filter_rows(image),self.compression)
+        if self.written == 0:
+            # The first frame is also the static image
+            self.write_chunk(b"IDAT",data)
+        else:
+            self.write_chunk(b"fdAT",struct.pack(">I",self.sequence) + data)
+            self.sequence += 1
+        self.written += 1
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.write_chunk(b"IEND",b"")
+        self.file.close()
+        if self.written != self.frames:
+            raise ValueError(f"Wrote {self.written} frames into an animation of {self.frames}")
+
+
+# The SVG the worker last rendered bands of, parsed once however many of its bands the worker renders
+_tile_source = None
+_tile_root = None
+
+
+def render_band(svg_string: bytes, y: int, width: int, height: int) -> np.ndarray:
+    """
+    Rasterize a full-width horizontal band of an SVG, by pointing its viewBox at the band
+
+    Args:
+        svg_string (bytes): Serialized canvas
+        y (int): Top of the band
+        width (int): Band (and canvas) width
+        height (int): Band height
+
+    Returns:
+        np.ndarray: HxWx4 uint8 RGBA pixels
+    """
+    global _tile_source,_tile_root
+    if svg_string != _tile_source:
+        _tile_source = svg_string
+        _tile_root = XML(svg_string)
+
+    _tile_root.set("width",f"{width}")
+    _tile_root.set("height",f"{height}")
+    _tile_root.set("viewBox",f"0 {y} {width} {height}")
+    png = a.rasterize(tostring(_tile_root),None,width,height)
+    return np.asarray(Image.open(BytesIO(png)).convert("RGBA"))
+
+
+@profiler.stage
+def export_tiled(svg_string: bytes,
+                 path: str,
+                 width: int,
+                 height: int,
+                 tile_height: int = 256,
+                 jobs: int = 1,
+                 pool: ProcessPoolExecutor = None) -> None:
+    """
+    Rasterize an SVG band by band and stream the bands into a PNG.
+    Peak memory is bounded by the band size (times the number of bands in flight), not the image size.
+
+    Args:
+        svg_string (bytes): Serialized canvas
+        path (str): Output path
+        width (int): Canvas width
+        height (int): Canvas height
+        tile_height (int): Height of each band in pixels
+        jobs (int): Number of worker processes rendering bands
+        pool (ProcessPoolExecutor): Pool of jobs workers to render the bands on, to share one across images.
+        A pool is started for this image if None and jobs > 1.
+    """
+    bands = [(y,width,min(tile_height,height - y)) for y in range(0,height,tile_height)]
+
+    with PNGWriter(path,width,height) as writer:
+        if jobs > 1 and pool is None:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                write_bands(writer,pool,svg_string,bands,jobs)
+        elif jobs > 1:
+            write_bands(writer,pool,svg_string,bands,jobs)
+        else:
+            for band in bands:
+                writer.write_rows(render_band(svg_string,*band))
+
+
+def write_bands(writer: PNGWriter, pool: ProcessPoolExecutor, svg_string: bytes, bands: list, jobs: int) -> None:
+    """
+    Render bands on a pool, keeping a bounded window of them in flight, and write them strictly in order
+    """
+    pending = deque()
+    for band in bands:
+        pending.append(pool.submit(render_band,svg_string,*band))
+        if len(pending) >= 2*jobs:
+            writer.write_rows(pending.popleft().result())
+    while pending:
+        writer.write_rows(pending.popleft().result())
@@ -0,0 +1,47 @@
+import artist as a
+import painter as p
+import main
+import os
+from functools import lru_cache
+
+
+# Render settings of the worker process, sent once when it starts
+settings = None
+
+def init(worker_settings: dict) -> None:
+    """
+    Worker process initializer, e.g. ProcessPoolExecutor(initializer=worker.init, initargs=(settings,))
+
+    Args:
+        worker_settings (dict): scale, star_count, star_alpha, seed and palette_dir,
+        and optionally the schedule palettes precompute their colour maps for
+    """
+    global settings
+    settings = worker_settings
+    # Drawn and parsed with the previous settings, when called again in the same process
+    load_template.cache_clear()
+    load_palettes.cache_clear()
+
+
+@lru_cache(maxsize=16)
+def load_template(constellation: str, width: int, height: int) -> a.SVGTemplate:
+    """
+    Draw and compile a constellation at a size once per worker. The scene is seeded,
+    so every worker (and every run) draws the same star layout for the same constellation and size.
+    """
+    canvas = main.draw(width,
+                       height,
+                       scale_factor=settings["scale"],
+                       star_count=settings["star_count"],
+                       star_alpha=settings["star_alpha"],
+                       constellation=constellation,
+                       seed=settings["seed"])
+    return canvas.compile(settings["star_alpha"])
+
+
+@lru_cache(maxsize=16)
+def load_palettes(palette: str) -> p.PaletteTable:
+    """
+    Parse a palette once per worker, with the colour maps of the settings' schedule if there is one
+    """
+    return p.PaletteTable(os.path.join(settings["palette_dir"],palette),settings.get("schedule",{}))